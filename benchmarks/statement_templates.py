@@ -0,0 +1,101 @@
+"""
+Benchmark rendering xAPI statements from precompiled templates against json.dumps.
+
+For each event type this times serializing a fully built statement dict with
+json.dumps (which is what every event used to do, not counting the time it
+took to build the dict) against rendering the same statement from the event's
+StatementTemplate.
+
+Usage: python benchmarks/statement_templates.py
+"""
+import json
+import timeit
+
+from xapi_db_load.generate_load import EVENTS
+from xapi_db_load.xapi.xapi_common import Slot
+
+NUMBER = 20000
+
+# Representative values for every slot used by the templates
+VALUES = {
+    "event_id": "1b2f5ee4-6a5f-4ea3-9a14-4d4bd4b1e9d0",
+    "account": "6a5f1b2f-4ea3-4d4b-9a14-d4b1e9d01b2f",
+    "actor_id": "6a5f1b2f-4ea3-4d4b-9a14-d4b1e9d01b2f",
+    "course_url": "http://localhost:18000/course/course-v1:Org1+a1b2c3+0",
+    "parent_activities": [
+        {
+            "id": "http://localhost:18000/course/course-v1:Org1+a1b2c3+0",
+            "objectType": "Activity",
+            "definition": {
+                "name": {"en-US": "Demonstration Course"},
+                "type": "http://adlnet.gov/expapi/activities/course",
+            },
+        }
+    ],
+    "course_object": {
+        "id": "http://localhost:18000/course/course-v1:Org1+a1b2c3+0",
+        "definition": {
+            "name": {"en": "Demonstration Course"},
+            "type": "http://adlnet.gov/expapi/activities/course",
+        },
+        "objectType": "Activity",
+    },
+    "timestamp": "2021-03-04T05:06:07",
+    "video_id": "http://localhost:18000/xblock/block-v1:Org1+a1b2c3+0+type@video+block@1b2f5ee4",
+    "problem_id": "http://localhost:18000/xblock/block-v1:Org1+a1b2c3+0+type@problem+block@1b2f5ee4",
+    "object_id": "http://localhost:18000/xblock/block-v1:Org1+a1b2c3+0+type@problem+block@1b2f5ee4/answer",
+    "sequential_id": "http://localhost:18000/xblock/block-v1:Org1+a1b2c3+0+type@sequential+block@1b2f5ee4",
+    "post_id": "http://localhost:18000/api/discussion/v1/threads/1b2f5ee4",
+    "enrollment_mode": "verified",
+    "grade_classification": "Pass",
+    "response": "A correct answer",
+    "from_loc": "12",
+    "to_loc": "next unit",
+    "items_in_course": 150,
+    "attempts": 3,
+    "max_score": 80,
+    "raw_score": 60,
+    "scaled_score": 0.75,
+    "success": True,
+    "video_event_time": 123.0,
+    "video_event_time_from": 12.0,
+    "video_event_time_to": 99.0,
+}
+
+
+def fill(statement):
+    """
+    Return a copy of the statement with all Slots replaced by their values.
+    """
+    if isinstance(statement, Slot):
+        return VALUES[statement.name]
+    if isinstance(statement, dict):
+        return {k: fill(v) for k, v in statement.items()}
+    if isinstance(statement, list):
+        return [fill(v) for v in statement]
+    return statement
+
+
+def main():
+    """
+    Print the per-statement timings for each event type.
+    """
+    encoded = {k: json.dumps(v) for k, v in VALUES.items()}
+
+    print(f"{'Event type':<25} {'json.dumps':>12} {'template':>12} {'speedup':>8}")
+    for event_class in EVENTS:
+        event = event_class(None)
+        statement = fill(event.get_statement_template())
+        assert event.template.render(**encoded) == json.dumps(statement)
+
+        dumps_time = timeit.timeit(lambda: json.dumps(statement), number=NUMBER) / NUMBER  # pylint: disable=cell-var-from-loop
+        render_time = timeit.timeit(lambda: event.template.render(**encoded), number=NUMBER) / NUMBER  # pylint: disable=cell-var-from-loop
+
+        print(
+            f"{event_class.__name__:<25} {dumps_time * 1e6:>10.2f}us {render_time * 1e6:>10.2f}us "
+            f"{dumps_time / render_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -20,9 +20,15 @@ setup(
     install_requires=[
         "click",
         "clickhouse-connect >= 0.5, < 0.7",
+        "numpy",
         "requests",
         "smart_open[s3]",
+        "zstandard",
     ],
+    extras_require={
+        # Needed for the parquet_file backend
+        "parquet": ["pyarrow"],
+    },
     url="https://github.com/openedx/xapi-db-load",
     project_urls={
         "Code": "https://github.com/openedx/xapi-db-load",
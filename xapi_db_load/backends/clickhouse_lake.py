@@ -1,11 +1,40 @@
 """
 ClickHouse data lake implementation.
 """
+import glob
 import os
+import queue
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import UTC, datetime
 
 import clickhouse_connect
+from clickhouse_connect.driver.summary import QuerySummary
+
+from xapi_db_load.backends.progress import QueryProgressMonitor
+from xapi_db_load.backends.schemas import FILE_FORMAT_EXTENSIONS, get_structure
+from xapi_db_load.compression import COMPRESSION_EXTENSIONS
+from xapi_db_load.ids import get_uuid
+from xapi_db_load.utils import log_duration
+
+# Bytes read from local files at a time when streaming them to ClickHouse
+LOCAL_LOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def get_deduplication_settings(event_ids, settings=None):
+    """
+    Return the insert settings with an insert_deduplication_token for the given event ids.
+
+    The token comes from the events, so inserting the same events again (ex.
+    a seeded batch regenerated after --resume, or a retry) gets the same
+    token and is dropped by ClickHouse on tables that deduplicate inserts.
+    """
+    settings = dict(settings or {})
+    if event_ids:
+        settings["insert_deduplication_token"] = f"{event_ids[0].hex()}-{len(event_ids)}"
+    return settings
 
 
 class XAPILakeClickhouse:
@@ -14,8 +43,14 @@ class XAPILakeClickhouse:
     """
 
     client = None
+    insert_contexts = None
+    insert_executor = None
+
+    # Inserts can be checkpointed and an interrupted run resumed
+    can_resume = True
 
     def __init__(self, config):
+        self.config = config
         self.host = config.get("db_host", "localhost")
         self.port = config.get("db_port", "18123")
         self.username = config.get("db_username", "default")
@@ -29,12 +64,58 @@ class XAPILakeClickhouse:
             "event_raw_table_name", "xapi_events_all"
         )
         self.event_table_name = config.get("event_table_name", "xapi_events_all_parsed")
+        self.insert_concurrency = config.get("db_insert_concurrency", 1)
+
+        # Async insert mode, sends small inserts that ClickHouse buffers server side
+        self.async_insert = config.get("db_async_insert", False)
+        self.async_insert_rows = config.get("db_async_insert_rows", 0)
+        self.inserts_per_second = config.get("db_inserts_per_second", 0)
+        self.event_insert_settings = None
+        if self.async_insert:
+            self.event_insert_settings = {
+                "async_insert": 1,
+                "wait_for_async_insert": 1 if config.get("db_wait_for_async_insert", True) else 0,
+                # Deduplication tokens are ignored for async inserts without this
+                "async_insert_deduplicate": 1,
+            }
+        self.pace_lock = threading.Lock()
+        self.next_insert_time = 0.0
+        self.batches_inserted = 0
+
+        # The pool of insert connections, started by the first batch when
+        # db_insert_concurrency is more than 1
+        self.insert_connections = None
+        self.connection_stats = {}
+        self.insert_slots = None
+        self.insert_futures = []
+        self.insert_errors = []
+        self.stats_lock = threading.Lock()
+        self.insert_pool_start = None
+
+        # Loading files from S3
+        self.s3_load_concurrency = config.get("s3_load_concurrency", 4)
+        self.s3_load_per_shard = config.get("s3_load_per_shard", False)
+        self.s3_cluster = config.get("s3_cluster")
+        self.s3_load_progress_interval = config.get("s3_load_progress_interval", 30)
+        self.local_load_concurrency = config.get("local_load_concurrency", 4)
+        self.load_clients = threading.local()
+        self.load_monitor = None
+
         self.set_client()
 
     def set_client(self):
         """
         Set up the ClickHouse client and connect.
         """
+        # Insert contexts hold the table column types, so they only need to be
+        # fetched from the server once per table.
+        self.insert_contexts = {}
+        self.client = self._get_client()
+
+    def _get_client(self):
+        """
+        Return a new ClickHouse client.
+        """
         client_options = {
             "date_time_input_format": "best_effort",  # Allows RFC dates
         }
@@ -44,7 +125,7 @@ class XAPILakeClickhouse:
         # and keeps us from adding yet another command line option.
         secure = str(self.port).endswith("443") or str(self.port).endswith("440")
 
-        self.client = clickhouse_connect.get_client(
+        return clickhouse_connect.get_client(
             host=self.host,
             username=self.username,
             password=self.db_password,
@@ -73,26 +154,236 @@ class XAPILakeClickhouse:
     def batch_insert(self, events):
         """
         Insert a batch of events to ClickHouse.
+
+        If db_insert_concurrency is greater than 1 the batch is handed off to
+        the pool of insert connections and this returns as soon as there is
+        room for it, finalize() waits for all outstanding inserts.
         """
-        out_data = []
-        for v in events:
-            try:
-                out = f"('{v['event_id']}', '{v['emission_time']}', '{v['event']}')"
-                out_data.append(out)
-            except Exception:
-                print(v)
-                raise
-        vals = ",".join(out_data)
-        sql = f"""
-                INSERT INTO {self.event_raw_table_name} (
-                    event_id,
-                    emission_time,
-                    event
-                )
-                VALUES {vals}
+        if self.insert_concurrency > 1:
+            self._submit_concurrent_insert(events)
+        else:
+            self._insert_events(events)
+
+    def _insert_events(self, events):
+        """
+        Insert a batch of events to ClickHouse on this lake's client.
+
+        Events are sent as typed, column oriented data using the client's
+        native insert format, so the server doesn't have to parse a giant
+        VALUES statement and the event JSON doesn't need any SQL escaping.
+        """
+        # The generator includes the UUID bytes and epoch seconds along with
+        # the strings, so nothing is parsed here. The client writes
+        # DateTime64 columns from ints as is, in microseconds for our
+        # precision of 6, so there's no timezone conversion either.
+        event_ids = [v["event_uuid"] for v in events]
+        emission_times = [v["emission_epoch"] * 1000000 for v in events]
+        statements = [v["event"] for v in events]
+
+        if self.async_insert:
+            self._insert_events_async(event_ids, emission_times, statements)
+        else:
+            self._insert_columns_with_retry(
+                self.event_raw_table_name,
+                ["event_id", "emission_time", "event"],
+                [event_ids, emission_times, statements],
+                settings=get_deduplication_settings(event_ids),
+            )
+
+    def _insert_events_async(self, event_ids, emission_times, statements):
+        """
+        Send event columns as a series of small async inserts.
+
+        This is the pattern event-routing-backends uses in production, lots of
+        small inserts that ClickHouse buffers and flushes to parts on its own.
+        When waiting for async inserts the duration of each insert includes
+        the time for the server to flush the buffer, so it is logged as the
+        flush latency.
+        """
+        timer_key = "flush_latency" if self.event_insert_settings["wait_for_async_insert"] else "insert_latency"
+        chunk_size = self.async_insert_rows or len(event_ids)
+
+        for i in range(0, len(event_ids), chunk_size):
+            columns = [
+                event_ids[i:i + chunk_size],
+                emission_times[i:i + chunk_size],
+                statements[i:i + chunk_size],
+            ]
+
+            self._pace_insert()
+            start = datetime.now()
+            self._insert_columns_with_retry(
+                self.event_raw_table_name,
+                ["event_id", "emission_time", "event"],
+                columns,
+                settings=get_deduplication_settings(columns[0], self.event_insert_settings),
+            )
+            log_duration("async_insert", timer_key, (datetime.now() - start).total_seconds(), rows=len(columns[0]))
+
+        # Parts are checked every so often to see how well the server is merging
+        self.batches_inserted += 1
+        if self.batches_inserted % 100 == 0:
+            self.log_part_counts()
+
+    def _pace_insert(self):
+        """
+        Sleep as needed to keep inserts at db_inserts_per_second, if set.
+        """
+        if not self.inserts_per_second:
+            return
+
+        with self.pace_lock:
+            now = time.monotonic()
+            wait = self.next_insert_time - now
+            self.next_insert_time = max(now, self.next_insert_time) + 1 / self.inserts_per_second
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def log_part_counts(self):
+        """
+        Log the number of active parts in the event tables.
+
+        Many small inserts can create parts faster than ClickHouse can merge
+        them, this is what async_insert is meant to prevent.
+        """
+        res = self.client.query(
             """
+            SELECT table, count(), sum(rows)
+            FROM system.parts
+            WHERE active
+                AND database = {database:String}
+                AND table IN ({raw_table:String}, {table:String})
+            GROUP BY table
+            """,
+            parameters={
+                "database": self.database,
+                "raw_table": self.event_raw_table_name,
+                "table": self.event_table_name,
+            },
+        )
+        for table, parts, rows in res.result_set:
+            log_duration("parts", table, 0, active_parts=parts, rows=rows)
+            print(f"   {table}: {parts} active parts, {rows} rows")
 
-        self._insert_sql_with_retry(sql)
+    def _start_insert_pool(self):
+        """
+        Open the pool of insert connections and the threads that send on them.
+        """
+        print(f"Inserting events with {self.insert_concurrency} concurrent ClickHouse connections")
+
+        # Each connection is a plain, single connection lake with its own client,
+        # and an even share of the overall inserts per second.
+        connection_config = dict(
+            self.config,
+            db_insert_concurrency=1,
+            db_inserts_per_second=self.inserts_per_second / self.insert_concurrency,
+        )
+        self.insert_connections = queue.Queue()
+        self.connection_stats = {}
+        for i in range(self.insert_concurrency):
+            self.insert_connections.put((i, XAPILakeClickhouse(connection_config)))
+            self.connection_stats[i] = {"rows": 0, "batches": 0, "duration": 0.0}
+
+        self.insert_executor = ThreadPoolExecutor(
+            max_workers=self.insert_concurrency,
+            thread_name_prefix="clickhouse_insert",
+        )
+        # Allow one waiting batch per connection so the connections never sit
+        # idle, but generation can't get too far ahead of them.
+        self.insert_slots = threading.BoundedSemaphore(self.insert_concurrency * 2)
+        self.insert_futures = []
+        self.insert_errors = []
+        self.stats_lock = threading.Lock()
+        self.insert_pool_start = datetime.now()
+
+    def _submit_concurrent_insert(self, events):
+        """
+        Queue a batch to be inserted on the next free connection.
+        """
+        if self.insert_executor is None:
+            self._start_insert_pool()
+
+        # Fail fast if a previous insert failed
+        if self.insert_errors:
+            raise self.insert_errors[0]
+
+        self.insert_slots.acquire()  # pylint: disable=consider-using-with
+        future = self.insert_executor.submit(self._insert_on_connection, events)
+        future.add_done_callback(self._concurrent_insert_done)
+        self.insert_futures = [f for f in self.insert_futures if not f.done()]
+        self.insert_futures.append(future)
+
+    def _concurrent_insert_done(self, future):
+        """
+        Free up the slot for a finished insert and keep any error for the main thread.
+        """
+        self.insert_slots.release()
+        if future.exception():
+            self.insert_errors.append(future.exception())
+
+    def _insert_on_connection(self, events):
+        """
+        Insert a batch of events on a free connection from the pool, logging its throughput.
+        """
+        index, connection = self.insert_connections.get()
+        try:
+            start = datetime.now()
+            connection.batch_insert(events)
+            duration = (datetime.now() - start).total_seconds()
+        finally:
+            self.insert_connections.put((index, connection))
+
+        log_duration(
+            "batch",
+            "connection_insert_events",
+            duration,
+            connection=index,
+            rows=len(events),
+            rows_per_second=len(events) / duration if duration else None,
+        )
+
+        with self.stats_lock:
+            stats = self.connection_stats[index]
+            stats["rows"] += len(events)
+            stats["batches"] += 1
+            stats["duration"] += duration
+
+    def _finish_concurrent_inserts(self):
+        """
+        Wait for all outstanding inserts, then log per-connection and aggregate throughput.
+        """
+        for future in self.insert_futures:
+            # Errors are collected by the done callback
+            future.exception()
+        self.insert_executor.shutdown()
+        self.insert_executor = None
+
+        if self.insert_errors:
+            raise self.insert_errors[0]
+
+        duration = (datetime.now() - self.insert_pool_start).total_seconds()
+        total_rows = 0
+        for index, stats in sorted(self.connection_stats.items()):
+            total_rows += stats["rows"]
+            log_duration(
+                "insert_connection",
+                f"connection_{index}",
+                stats["duration"],
+                rows=stats["rows"],
+                batches=stats["batches"],
+                rows_per_second=stats["rows"] / stats["duration"] if stats["duration"] else None,
+            )
+
+        log_duration(
+            "insert_connection",
+            "all_connections",
+            duration,
+            connections=self.insert_concurrency,
+            rows=total_rows,
+            rows_per_second=total_rows / duration if duration else None,
+        )
+        print(f"Inserted {total_rows:,} rows over {self.insert_concurrency} connections in {duration:.2f}s")
 
     def insert_event_sink_course_data(self, courses, num_course_publishes):
         """
@@ -105,7 +396,7 @@ class XAPILakeClickhouse:
             out_data = []
             for course in courses:
                 c = course.serialize_course_data_for_event_sink()
-                dump_id = str(uuid.uuid4())
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
                 try:
                     out = f"""(
@@ -141,7 +432,7 @@ class XAPILakeClickhouse:
             blocks, object_tags = course.serialize_block_data_for_event_sink()
 
             for i in range(num_course_publishes):
-                dump_id = str(uuid.uuid4())
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
                 for b in blocks:
                     try:
@@ -171,18 +462,11 @@ class XAPILakeClickhouse:
         This allows us to test PII reports.
         """
         out_external_id = []
-        for actor in actors:
-            dump_id = str(uuid.uuid4())
+        for external_id_row in actors.external_id_rows():
+            dump_id = get_uuid()
             dump_time = datetime.now(UTC)
-            id_row = f"""(
-                '{actor.id}',
-                'xapi',
-                '{actor.username}',
-                '{actor.user_id}',
-                '{dump_id}',
-                '{dump_time}'
-            )"""
-            out_external_id.append(id_row)
+            values = ", ".join(f"'{v}'" for v in (*external_id_row, dump_id, dump_time))
+            out_external_id.append(f"({values})")
 
         self._insert_list_sql_retry(out_external_id, "external_id")
 
@@ -190,38 +474,11 @@ class XAPILakeClickhouse:
         for i in range(num_actor_profile_changes):
             print(f"   Actor save round {i} - {datetime.now().isoformat()}")
 
-            for actor in actors:
-                dump_id = str(uuid.uuid4())
+            for profile_row in actors.profile_rows():
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
-
-                # This first column is usually the MySQL row pk, we just
-                # user this for now to have a unique id.
-                profile_row = f"""(
-                    '{actor.user_id}',
-                    '{actor.user_id}',
-                    '{actor.name}',
-                    '{actor.username}',
-                    '{actor.username}@aspects.invalid',
-                    '{actor.meta}',
-                    '{actor.courseware}',
-                    '{actor.language}',
-                    '{actor.location}',
-                    '{actor.year_of_birth}',
-                    '{actor.gender}',
-                    '{actor.level_of_education}',
-                    '{actor.mailing_address}',
-                    '{actor.city}',
-                    '{actor.country}',
-                    '{actor.state}',
-                    '{actor.goals}',
-                    '{actor.bio}',
-                    '{actor.profile_image_uploaded_at}',
-                    '{actor.phone_number}',
-                    '{dump_id}',
-                    '{dump_time}'
-                )"""
-
-                out_profile.append(profile_row)
+                values = ", ".join(f"'{v}'" for v in (*profile_row, dump_id, dump_time))
+                out_profile.append(f"({values})")
 
             self._insert_list_sql_retry(out_profile, "user_profile")
 
@@ -229,7 +486,7 @@ class XAPILakeClickhouse:
         """
         Insert the taxonomies into the event sink db.
         """
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
         i = 1
         out_data = []
@@ -250,7 +507,7 @@ class XAPILakeClickhouse:
         """
         Insert the tags into the event sink db.
         """
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
 
         tag_out_data = []
@@ -276,7 +533,7 @@ class XAPILakeClickhouse:
 
         Most of the work for this is done in insert_event_sink_block_data
         """
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
         obj_tag_out_data = []
 
@@ -314,6 +571,40 @@ class XAPILakeClickhouse:
 
         self._insert_sql_with_retry(sql)
 
+    def _insert_columns_with_retry(self, table, column_names, columns, settings=None):
+        """
+        Insert column oriented data to a table, with a single retry.
+        """
+        # Sometimes the connection randomly dies, this gives us a second shot in that case
+        try:
+            self._insert_columns(table, column_names, columns, settings)
+        except clickhouse_connect.driver.exceptions.OperationalError:
+            print("ClickHouse OperationalError, trying to reconnect.")
+            self.set_client()
+            print("Retrying insert...")
+            self._insert_columns(table, column_names, columns, settings)
+
+    def _insert_columns(self, table, column_names, columns, settings=None):
+        """
+        Insert column oriented data to a table, reusing the insert context for the table.
+        """
+        context = self.insert_contexts.get(table)
+        if context is None:
+            context = self.client.create_insert_context(
+                table,
+                column_names=column_names,
+                column_oriented=True,
+                settings=settings,
+            )
+            self.insert_contexts[table] = context
+
+        # Settings can differ between inserts, ex: deduplication tokens
+        context.settings = dict(settings or {})
+
+        # A failed insert leaves its data on the context
+        context.data = None
+        self.client.insert(data=columns, context=context)
+
     def _insert_sql_with_retry(self, sql):
         """
         Wrap insert commands with a single retry.
@@ -331,65 +622,330 @@ class XAPILakeClickhouse:
             print(sql)
             raise
 
-    def load_from_s3(self, s3_location):
+    def _get_load_files(self, location):
         """
-        Load generated csv.gz files from S3.
+        Return the format of the generated files, and the table, file type and path of each file to load.
 
-        This does a bulk file insert directly from S3 to ClickHouse, so files
-        never get downloaded directly to the local process.
+        The format comes from the "file_format" config. Compressed formats
+        are expected to use the configured csv_compression. The xAPI path is
+        a glob, since events can be split over many shards.
         """
-        loads = (
+        file_format = self.config.get("file_format", "CSV")
+        ext = FILE_FORMAT_EXTENSIONS[file_format]
+        if file_format != "Parquet":
+            ext += f".{COMPRESSION_EXTENSIONS[self.config.get('csv_compression', 'gzip')]}"
+
+        return file_format, [
             (
                 f"{self.event_sink_database}.course_overviews",
-                os.path.join(s3_location, "courses.csv.gz"),
+                "courses",
+                os.path.join(location, f"courses.{ext}"),
             ),
             (
                 f"{self.event_sink_database}.course_blocks",
-                os.path.join(s3_location, "blocks.csv.gz"),
+                "blocks",
+                os.path.join(location, f"blocks.{ext}"),
             ),
             (
                 f"{self.event_sink_database}.external_id",
-                os.path.join(s3_location, "external_ids.csv.gz"),
+                "external_ids",
+                os.path.join(location, f"external_ids.{ext}"),
             ),
             (
                 f"{self.event_sink_database}.user_profile",
-                os.path.join(s3_location, "user_profiles.csv.gz"),
+                "user_profiles",
+                os.path.join(location, f"user_profiles.{ext}"),
             ),
-
             (
                 f"{self.event_sink_database}.taxonomy",
-                os.path.join(s3_location, "taxonomies.csv.gz"),
+                "taxonomies",
+                os.path.join(location, f"taxonomies.{ext}"),
             ),
             (
                 f"{self.event_sink_database}.tag",
-                os.path.join(s3_location, "tags.csv.gz"),
+                "tags",
+                os.path.join(location, f"tags.{ext}"),
             ),
             (
                 f"{self.event_sink_database}.object_tag",
-                os.path.join(s3_location, "object_tags.csv.gz"),
+                "object_tags",
+                os.path.join(location, f"object_tags.{ext}"),
             ),
-
             (
                 f"{self.database}.{self.event_raw_table_name}",
-                os.path.join(s3_location, "xapi.csv.gz"),
+                "xapi",
+                os.path.join(location, f"xapi*.{ext}"),
             ),
+        ]
+
+    def load_from_s3(self, s3_location):
+        """
+        Load generated files from S3.
+
+        This does a bulk file insert directly from S3 to ClickHouse, so files
+        never get downloaded directly to the local process. ClickHouse picks
+        the decompression from the file extension.
+
+        Up to s3_load_concurrency inserts run at once, each thread with its
+        own connection. xAPI shards are read with s3Cluster if s3_cluster is
+        set, or with one insert per shard if s3_load_per_shard is set.
+        """
+        file_format, loads = self._get_load_files(s3_location)
+
+        # ClickHouse reads all of the files matching the xAPI glob in parallel
+        # by default.
+        if self.s3_load_per_shard and not self.s3_cluster:
+            xapi_table, _, xapi_glob = loads.pop()
+            loads.extend(
+                (xapi_table, "xapi", os.path.join(s3_location, shard))
+                for shard in self._list_s3_files(xapi_glob)
+            )
+
+        inserts = [
+            (table_name, file_path, self._get_s3_insert(table_name, file_type, file_path, file_format))
+            for table_name, file_type, file_path in loads
+        ]
+        self._run_loads("s3_load", inserts, self.s3_load_concurrency)
+
+    def load_from_local(self, local_location):
+        """
+        Load generated files from a local directory.
+
+        Files are streamed to ClickHouse over HTTP as they are on disk,
+        ClickHouse decompresses them based on the Content-Encoding. Up to
+        local_load_concurrency files are sent at once, each thread with its
+        own connection.
+        """
+        file_format, file_globs = self._get_load_files(local_location)
+
+        inserts = []
+        for table_name, _, file_glob in file_globs:
+            file_paths = sorted(glob.glob(file_glob))
+            if not file_paths:
+                raise FileNotFoundError(f"No files found for {table_name} matching {file_glob}")
+            inserts.extend(
+                (table_name, file_path, self._get_local_insert(table_name, file_path, file_format))
+                for file_path in file_paths
+            )
+
+        self._run_loads("local_load", inserts, self.local_load_concurrency)
+
+    def _list_s3_files(self, s3_glob):
+        """
+        Return the sorted names of the S3 files matching a glob, as ClickHouse sees them.
+        """
+        res = self.client.query(
+            f"SELECT DISTINCT _file FROM s3('{s3_glob}', '{self.s3_key}', '{self.s3_secret}', 'One')"
         )
+        return sorted(row[0] for row in res.result_set)
 
-        for table_name, file_path in loads:
-            print(f"Inserting into {table_name}")
+    def _run_loads(self, timer_type, inserts, concurrency):
+        """
+        Run each (table, path, insert) load, up to concurrency at a time.
 
-            sql = f"""
-            INSERT INTO {table_name}
-               SELECT *
-               FROM s3('{file_path}', '{self.s3_key}', '{self.s3_secret}', 'CSV');
-            """
+        insert is a function that runs the insert for the file on a given
+        client, with the given settings.
+        """
+        print(f"Loading {len(inserts)} files with {concurrency} concurrent inserts")
 
-            self.client.command(sql)
-            self.print_db_time()
+        # The inserts don't return until they're done, so watch them from
+        # another connection while they run.
+        if self.s3_load_progress_interval:
+            self.load_monitor = QueryProgressMonitor(
+                self._get_client(),
+                self.s3_load_progress_interval,
+                self.s3_cluster,
+            )
+            self.load_monitor.start()
+
+        start = datetime.now()
+        try:
+            if concurrency > 1:
+                with ThreadPoolExecutor(
+                    max_workers=concurrency,
+                    thread_name_prefix=timer_type,
+                    initializer=self._init_load_thread,
+                ) as executor:
+                    futures = [
+                        executor.submit(self._run_load, timer_type, table_name, file_path, insert)
+                        for table_name, file_path, insert in inserts
+                    ]
+                    results = [future.result() for future in futures]
+            else:
+                results = [
+                    self._run_load(timer_type, table_name, file_path, insert)
+                    for table_name, file_path, insert in inserts
+                ]
+        finally:
+            if self.load_monitor is not None:
+                self.load_monitor.stop()
+                self.load_monitor = None
+
+        self._log_load_totals(timer_type, results, (datetime.now() - start).total_seconds(), concurrency)
+        self.print_db_time()
+
+    def _init_load_thread(self):
+        """
+        Give each load thread its own connection, so inserts aren't serialized on one HTTP session.
+        """
+        self.load_clients.client = self._get_client()
+
+    def _get_s3_insert(self, table_name, file_type, file_path, file_format):
+        """
+        Return a function that inserts a file, or glob of files, from S3 into a table.
+        """
+        # RowBinary has no header and ClickHouse can't reliably infer
+        # the types of JSON columns in TabSeparated, so give it the
+        # structure we wrote.
+        structure = ""
+        if file_format in ("RowBinary", "TabSeparated"):
+            escaped = get_structure(file_type).replace("'", "\\'")
+            structure = f", '{escaped}'"
+
+        source = "s3("
+        if self.s3_cluster and file_type == "xapi":
+            source = f"s3Cluster('{self.s3_cluster}', "
+
+        sql = f"""
+        INSERT INTO {table_name}
+           SELECT *
+           FROM {source}'{file_path}', '{self.s3_key}', '{self.s3_secret}', '{file_format}'{structure});
+        """
+
+        return lambda client, settings: client.command(sql, settings=settings)
+
+    def _get_local_insert(self, table_name, file_path, file_format):
+        """
+        Return a function that streams a local file into a table.
+
+        The file is sent still compressed, the columns come from the table.
+        """
+        compression = None
+        for name, extension in COMPRESSION_EXTENSIONS.items():
+            if file_path.endswith(f".{extension}"):
+                compression = name
+
+        def insert(client, settings):
+            with open(file_path, "rb") as f:
+                return client.raw_insert(
+                    table_name,
+                    insert_block=iter(lambda: f.read(LOCAL_LOAD_CHUNK_SIZE), b""),
+                    settings=settings,
+                    fmt=file_format,
+                    compression=compression,
+                )
+
+        return insert
+
+    def _run_load(self, timer_type, table_name, file_path, insert):
+        """
+        Run the insert for one file and log its throughput.
+
+        Returns the table, start and end time, rows and bytes of the insert.
+        """
+        print(f"Inserting {file_path} into {table_name}", flush=True)
+
+        query_id = str(uuid.uuid4())
+        if self.load_monitor is not None:
+            self.load_monitor.watch(query_id, table_name, f"{table_name} from {os.path.basename(file_path)}")
+
+        # Load threads have their own connection
+        client = getattr(self.load_clients, "client", self.client)
+
+        start = datetime.now()
+        try:
+            summary = insert(client, {"query_id": query_id})
+        finally:
+            if self.load_monitor is not None:
+                self.load_monitor.unwatch(query_id)
+        end = datetime.now()
+
+        # Inserts return a summary of what was read and written
+        counts = summary.summary if isinstance(summary, QuerySummary) else {}
+        rows = int(counts.get("written_rows", 0))
+        written_bytes = int(counts.get("written_bytes", 0))
+        duration = (end - start).total_seconds()
+
+        log_duration(
+            f"{timer_type}_file",
+            table_name,
+            duration,
+            file=file_path,
+            query_id=query_id,
+            rows=rows,
+            bytes=written_bytes,
+            rows_per_second=rows / duration if duration else None,
+            bytes_per_second=written_bytes / duration if duration else None,
+        )
+        return table_name, start, end, rows, written_bytes
+
+    def _log_load_totals(self, timer_type, results, duration, concurrency):
+        """
+        Log the row and byte throughput of each table, and of the whole load.
+        """
+        tables = {}
+        for table_name, start, end, rows, written_bytes in results:
+            if table_name not in tables:
+                tables[table_name] = {"start": start, "end": end, "rows": 0, "bytes": 0, "files": 0}
+            table = tables[table_name]
+            table["start"] = min(table["start"], start)
+            table["end"] = max(table["end"], end)
+            table["rows"] += rows
+            table["bytes"] += written_bytes
+            table["files"] += 1
+
+        for table_name, table in tables.items():
+            table_duration = (table["end"] - table["start"]).total_seconds()
+            log_duration(
+                timer_type,
+                table_name,
+                table_duration,
+                files=table["files"],
+                rows=table["rows"],
+                bytes=table["bytes"],
+                rows_per_second=table["rows"] / table_duration if table_duration else None,
+                bytes_per_second=table["bytes"] / table_duration if table_duration else None,
+            )
+
+        total_rows = sum(table["rows"] for table in tables.values())
+        total_bytes = sum(table["bytes"] for table in tables.values())
+        log_duration(
+            timer_type,
+            "all_tables",
+            duration,
+            concurrency=concurrency,
+            rows=total_rows,
+            bytes=total_bytes,
+            rows_per_second=total_rows / duration if duration else None,
+            bytes_per_second=total_bytes / duration if duration else None,
+        )
+        print(f"Loaded {total_rows:,} rows from {len(results)} files in {duration:.2f}s")
+
+    def flush(self):
+        """
+        Wait for every batch given to batch_insert so far to be inserted.
+        """
+        if self.insert_executor is not None:
+            for future in self.insert_futures:
+                # Errors are collected by the done callback
+                future.exception()
+
+            if self.insert_errors:
+                raise self.insert_errors[0]
 
     def finalize(self):
         """
-        Nothing to finalize here.
+        Wait for any concurrent inserts to finish.
+        """
+        if self.insert_executor is not None:
+            self._finish_concurrent_inserts()
+
+        if self.async_insert:
+            self.log_part_counts()
+
+    def abort(self):
+        """
+        Clean up after a failed run, concurrent inserts finish on their own so there is nothing to stop.
         """
 
     def _run_query_and_print(self, query_name, query):
@@ -413,7 +969,7 @@ class XAPILakeClickhouse:
         course = event_generator.get_course()
         course_url = course.course_url
         org = event_generator.get_org()
-        actor = course.get_enrolled_actor().actor.id
+        actor = course.get_enrolled_actor().actor_id
 
         self._run_query_and_print(
             "Count of enrollment events for course {course_url}",
@@ -1,40 +1,249 @@
 """
 CSV Lake implementation.
 
-This can be used to generate a gzipped csv of events that can be loaded into any system.
+This can be used to generate a gzipped csv of events that can be loaded into any system,
+or files in one of the ClickHouse native formats.
 """
 
 import csv
+import io
+import multiprocessing
 import os
-import uuid
+import queue
 from datetime import UTC, datetime
 
 from smart_open import open as smart
 
+from xapi_db_load.backends.formats import FORMAT_WRITERS, TabSeparatedWriter
+from xapi_db_load.backends.schemas import FILE_FORMAT_EXTENSIONS
+from xapi_db_load.compression import COMPRESSION_EXTENSIONS, BlockCompressingWriter
+from xapi_db_load.ids import get_uuid
+from xapi_db_load.utils import ConfigurationError
+
+
+def get_file_name(file_type, shard=None):
+    """
+    Return the base file name for a file type, or for one shard of it (ex: xapi_00001).
+    """
+    return file_type if shard is None else f"{file_type}_{shard:05d}"
+
+
+def open_compressed_output(file_name, extension, output_destination, compression_options=None):
+    """
+    Open a file for writing through a BlockCompressingWriter, returning the binary writer.
+
+    The compression extension is added to the file name, ex: xapi_00001.csv.gz
+    """
+    compression_options = compression_options or {}
+    compression_extension = COMPRESSION_EXTENSIONS[compression_options.get("compression", "gzip")]
+    out_filepath = os.path.join(output_destination, f"{file_name}.{extension}.{compression_extension}")
+    os.makedirs(output_destination, exist_ok=True)
+
+    # smart_open only writes the file, compression is done by our own writer
+    return BlockCompressingWriter(smart(out_filepath, "wb", compression="disable"), **compression_options)
+
+
+def get_file_handle(file_type, output_destination, handle_options=None, shard=None):
+    """
+    Open a compressed file for writing, returning the file handle and a writer for it.
+
+    handle_options["file_format"] is the ClickHouse format to write, CSV by
+    default, and handle_options["compression"] are passed to
+    BlockCompressingWriter, by default the file is gzipped. Writers all
+    have a writerow method like a csv writer.
+    """
+    handle_options = handle_options or {}
+    file_format = handle_options.get("file_format", "CSV")
+    output = open_compressed_output(
+        get_file_name(file_type, shard),
+        FILE_FORMAT_EXTENSIONS[file_format],
+        output_destination,
+        handle_options.get("compression"),
+    )
+
+    if file_format == "CSV":
+        file_handle = io.TextIOWrapper(output, encoding="utf-8")
+        return file_handle, csv.writer(file_handle)
+
+    if file_format == "TabSeparated":
+        writer = TabSeparatedWriter(output)
+    else:
+        writer = FORMAT_WRITERS[file_format](output, file_type)
+    return writer, writer
+
+
+class ShardWriter:
+    """
+    Writes rows to a series of numbered shards, ex: xapi_00000.csv.gz.
+
+    A new shard is started when the current one reaches max_rows rows or
+    max_bytes bytes of uncompressed data, if those are set. Shard numbers
+    come from shard_counter, a multiprocessing.Value, so that several
+    writers in different processes never use the same number.
+
+    open_handle is the function used to open each shard, get_file_handle or
+    an equivalent for other file formats, and is called with handle_options.
+    """
+
+    def __init__(
+        self,
+        open_handle,
+        file_type,
+        output_destination,
+        shard_counter,
+        max_rows=0,
+        max_bytes=0,
+        handle_options=None
+    ):
+        self.open_handle = open_handle
+        self.file_type = file_type
+        self.output_destination = output_destination
+        self.handle_options = handle_options
+        self.shard_counter = shard_counter
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self.handle = None
+        self.writer = None
+        self.shard_rows = 0
+        self.shard_bytes = 0
+
+    def _next_shard(self):
+        """
+        Close the current shard, if any, and open the next one.
+        """
+        self.close()
+
+        with self.shard_counter.get_lock():
+            shard_number = self.shard_counter.value
+            self.shard_counter.value += 1
+
+        self.handle, self.writer = self.open_handle(
+            self.file_type,
+            self.output_destination,
+            self.handle_options,
+            shard=shard_number,
+        )
+        self.shard_rows = 0
+        self.shard_bytes = 0
+
+    def write_rows(self, rows):
+        """
+        Write rows of (event_id, emission_time, event), or their typed values, to the shards.
+        """
+        for row in rows:
+            rows_full = self.max_rows and self.shard_rows >= self.max_rows
+            bytes_full = self.max_bytes and self.shard_bytes >= self.max_bytes
+            if self.handle is None or rows_full or bytes_full:
+                self._next_shard()
+
+            self.writer.writerow(row)
+            self.shard_rows += 1
+            # Close enough to the written size, without quoting and delimiters.
+            # Typed rows have their emission time as an 8 byte number.
+            emission_time_bytes = len(row[1]) if isinstance(row[1], str) else 8
+            self.shard_bytes += len(row[0]) + emission_time_bytes + len(row[2])
+
+    def close(self):
+        """
+        Close the current shard, if one is open.
+        """
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+def _shard_writer_process(row_queue, *shard_args):
+    """
+    Write batches of rows from the queue to shards until a None is received.
+    """
+    writer = ShardWriter(*shard_args)
+    while True:
+        rows = row_queue.get()
+        if rows is None:
+            break
+        writer.write_rows(rows)
+    writer.close()
+
 
 class XAPILakeCSV:
     """
     CSV fake data lake implementation.
+
+    Subclasses can write other file formats by overriding open_handle, which
+    must return a file handle and a writer with a writerow method like the
+    csv module's, and get_handle_options.
     """
 
+    open_handle = staticmethod(get_file_handle)
+
+    # Files are rewritten from scratch, so an interrupted run can't be resumed
+    can_resume = False
+
     def __init__(self, config):
         self.output_destination = config["csv_output_destination"]
-
-        self.xapi_csv_handle, self.xapi_csv_writer = self._get_csv_handle(
-            "xapi", self.output_destination
+        self.handle_options = self.get_handle_options(config)
+
+        # xAPI events are written to numbered shards, by this process or by
+        # a pool of writer processes so compression isn't limited to one core.
+        self.num_writers = config.get("csv_writers", 1)
+        shard_counter = multiprocessing.Value("i", 0)
+        shard_args = (
+            self.open_handle,
+            "xapi",
+            self.output_destination,
+            shard_counter,
+            config.get("csv_shard_rows", 0),
+            config.get("csv_shard_bytes", 0),
+            self.handle_options,
         )
 
-        self.object_tag_csv_handle, self.object_tag_csv_writer = self._get_csv_handle(
-            "object_tags", self.output_destination
+        self.xapi_shard_writer = None
+        self.writer_processes = []
+        if self.num_writers > 1:
+            self.xapi_row_queue = multiprocessing.Queue(maxsize=self.num_writers * 2)
+            for i in range(self.num_writers):
+                process = multiprocessing.Process(
+                    target=_shard_writer_process,
+                    args=(self.xapi_row_queue,) + shard_args,
+                    name=f"csv_writer_{i}",
+                    # Never keep the interpreter alive waiting on rows that will not come
+                    daemon=True,
+                )
+                process.start()
+                self.writer_processes.append(process)
+        else:
+            self.xapi_shard_writer = ShardWriter(*shard_args)
+
+        self.object_tag_csv_handle, self.object_tag_csv_writer = self.open_handle(
+            "object_tags", self.output_destination, self.handle_options
         )
 
+        # Binary formats write xAPI ids and times from the generator's typed
+        # values, the rest take the strings.
+        file_format = self.handle_options.get("file_format", "CSV")
+        self.typed_xapi_rows = file_format in FORMAT_WRITERS and FORMAT_WRITERS[file_format].typed_rows
+
         self.row_count = 0
 
-    def _get_csv_handle(self, file_type, output_destination):
-        out_filepath = os.path.join(output_destination, f"{file_type}.csv.gz")
-        os.makedirs(output_destination, exist_ok=True)
-        file_handle = smart(out_filepath, "w", compression=".gz")
-        return file_handle, csv.writer(file_handle)
+    def get_handle_options(self, config):
+        """
+        Return the options passed to open_handle for every file, the file format and compression settings.
+        """
+        file_format = config.get("file_format", "CSV")
+        if file_format != "CSV" and file_format not in FORMAT_WRITERS:
+            raise ConfigurationError(
+                f"Unsupported file_format {file_format}, must be one of {['CSV'] + list(FORMAT_WRITERS)}."
+            )
+
+        return {
+            "file_format": file_format,
+            "compression": {
+                "compression": config.get("csv_compression", "gzip"),
+                "level": config.get("csv_compression_level"),
+                "threads": config.get("csv_compression_threads", 1),
+            },
+        }
 
     def print_db_time(self):
         """
@@ -68,17 +277,36 @@ class XAPILakeCSV:
         """
         Write a batch of rows to the CSV.
         """
-        for v in events:
-            out = (v["event_id"], v["emission_time"], str(v["event"]))
-            self.xapi_csv_writer.writerow(out)
+        if self.typed_xapi_rows:
+            rows = [(v["event_uuid"], v["emission_epoch"], str(v["event"])) for v in events]
+        else:
+            rows = [(v["event_id"], v["emission_time"], str(v["event"])) for v in events]
+
+        if self.xapi_shard_writer:
+            self.xapi_shard_writer.write_rows(rows)
+        else:
+            self._queue_rows(rows)
+
         self.row_count += len(events)
 
+    def _queue_rows(self, rows):
+        """
+        Send rows to the writer processes, making sure they are still alive while waiting.
+        """
+        while True:
+            try:
+                self.xapi_row_queue.put(rows, timeout=1)
+                return
+            except queue.Full:
+                if not all(p.is_alive() for p in self.writer_processes):
+                    raise RuntimeError("A CSV writer process has died, stopping.") from None
+
     def insert_event_sink_course_data(self, courses, num_course_publishes):
         """
         Write the course overview data.
         """
-        course_csv_handle, course_csv_writer = self._get_csv_handle(
-            "courses", self.output_destination
+        course_csv_handle, course_csv_writer = self.open_handle(
+            "courses", self.output_destination, self.handle_options
         )
 
         for i in range(num_course_publishes):
@@ -86,7 +314,7 @@ class XAPILakeCSV:
 
             for course in courses:
                 c = course.serialize_course_data_for_event_sink()
-                dump_id = str(uuid.uuid4())
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
                 course_csv_writer.writerow(
                     (
@@ -112,15 +340,15 @@ class XAPILakeCSV:
         """
         Write out the block data file.
         """
-        blocks_csv_handle, blocks_csv_writer = self._get_csv_handle(
-            "blocks", self.output_destination
+        blocks_csv_handle, blocks_csv_writer = self.open_handle(
+            "blocks", self.output_destination, self.handle_options
         )
 
         for course in courses:
             blocks, object_tags = course.serialize_block_data_for_event_sink()
 
             for i in range(num_course_publishes):
-                dump_id = str(uuid.uuid4())
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
                 for b in blocks:
                     blocks_csv_writer.writerow(
@@ -146,10 +374,10 @@ class XAPILakeCSV:
         """
         Write out the taxonomies data file.
         """
-        taxonomy_handle, taxonomy_csv_writer = self._get_csv_handle(
-            "taxonomies", self.output_destination
+        taxonomy_handle, taxonomy_csv_writer = self.open_handle(
+            "taxonomies", self.output_destination, self.handle_options
         )
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
         i = 1
         for taxonomy in taxonomies.keys():
@@ -162,10 +390,10 @@ class XAPILakeCSV:
         """
         Insert the tags into the event sink db.
         """
-        tag_csv_handle, tag_csv_writer = self._get_csv_handle(
-            "tags", self.output_destination
+        tag_csv_handle, tag_csv_writer = self.open_handle(
+            "tags", self.output_destination, self.handle_options
         )
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
 
         for tag in tags:
@@ -191,7 +419,7 @@ class XAPILakeCSV:
         Don't open and close the file handle here as we don't want
         to overwrite the file every time this gets called!
         """
-        dump_id = str(uuid.uuid4())
+        dump_id = get_uuid()
         dump_time = datetime.now(UTC)
 
         row_id = 0
@@ -216,74 +444,64 @@ class XAPILakeCSV:
         """
         Write out the user profile data and external id files.
         """
-        external_id_csv_handle, external_id_csv_writer = self._get_csv_handle(
-            "external_ids", self.output_destination
+        external_id_csv_handle, external_id_csv_writer = self.open_handle(
+            "external_ids", self.output_destination, self.handle_options
         )
 
-        for actor in actors:
-            dump_id = str(uuid.uuid4())
+        for external_id_row in actors.external_id_rows():
+            dump_id = get_uuid()
             dump_time = datetime.now(UTC)
 
-            external_id_csv_writer.writerow(
-                (
-                    actor.id,
-                    "xapi",
-                    actor.username,
-                    actor.user_id,
-                    dump_id,
-                    dump_time,
-                )
-            )
+            external_id_csv_writer.writerow((*external_id_row, dump_id, dump_time))
 
         external_id_csv_handle.close()
 
-        profile_csv_handle, profile_csv_writer = self._get_csv_handle(
-            "user_profiles", self.output_destination
+        profile_csv_handle, profile_csv_writer = self.open_handle(
+            "user_profiles", self.output_destination, self.handle_options
         )
         for i in range(num_actor_profile_changes):
             print(f"   Actor save round {i} - {datetime.now().isoformat()}")
-            for actor in actors:
-                dump_id = str(uuid.uuid4())
+            for profile_row in actors.profile_rows():
+                dump_id = get_uuid()
                 dump_time = datetime.now(UTC)
 
-                profile_csv_writer.writerow(
-                    (
-                        # This first column is usually the MySQL row pk, we just
-                        # user this for now to have a unique id.
-                        actor.user_id,
-                        actor.user_id,
-                        actor.name,
-                        actor.username,
-                        f"{actor.username}@aspects.invalid",
-                        actor.meta,
-                        actor.courseware,
-                        actor.language,
-                        actor.location,
-                        actor.year_of_birth,
-                        actor.gender,
-                        actor.level_of_education,
-                        actor.mailing_address,
-                        actor.city,
-                        actor.country,
-                        actor.state,
-                        actor.goals,
-                        actor.bio,
-                        actor.profile_image_uploaded_at,
-                        actor.phone_number,
-                        dump_id,
-                        dump_time,
-                    )
-                )
+                profile_csv_writer.writerow((*profile_row, dump_id, dump_time))
 
         profile_csv_handle.close()
 
+    def flush(self):
+        """
+        Nothing to wait for, rows are handed to the writers as they come in.
+        """
+
     def finalize(self):
         """
         Close file handles so that they can be readable on import.
         """
-        self.xapi_csv_handle.close()
+        if self.xapi_shard_writer:
+            self.xapi_shard_writer.close()
+        else:
+            for _ in self.writer_processes:
+                self.xapi_row_queue.put(None)
+            for process in self.writer_processes:
+                process.join()
+                if process.exitcode != 0:
+                    raise RuntimeError(f"CSV writer process {process.name} failed with exit code {process.exitcode}.")
+
         self.object_tag_csv_handle.close()
 
+    def abort(self):
+        """
+        Stop the writer processes after a failed run, without waiting for them to write what's queued.
+        """
+        if self.writer_processes:
+            # Otherwise exiting waits for queued rows to be read by writers that are gone
+            self.xapi_row_queue.cancel_join_thread()
+            for process in self.writer_processes:
+                process.terminate()
+                process.join()
+            self.writer_processes = []
+
     def do_queries(self, event_generator):
         """
         Execute queries, not needed here.
@@ -0,0 +1,221 @@
+"""
+Writers for the ClickHouse native file formats: TabSeparated, RowBinary and Native.
+
+These all have a writerow method like a csv writer, so the file backends can
+use them interchangeably. They avoid the quoting that CSV needs around the
+large JSON payloads, which is expensive both to write and for ClickHouse to
+parse. Columns are written using the types in FILE_SCHEMAS.
+"""
+import struct
+import uuid
+
+from xapi_db_load.backends.schemas import FILE_SCHEMAS
+
+# Number of rows in each block of a Native file
+NATIVE_BLOCK_ROWS = 65536
+
+# TabSeparated escape sequences for characters that can't appear in a value
+_TSV_ESCAPES = str.maketrans({
+    "\\": "\\\\",
+    "\t": "\\t",
+    "\n": "\\n",
+    "\r": "\\r",
+    "\0": "\\0",
+})
+
+
+def _encode_varint(value):
+    """
+    Return the LEB128 encoding ClickHouse uses for string lengths and counts.
+    """
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _encode_string(value):
+    """
+    Return a value as a length prefixed UTF-8 string, None as an empty string.
+    """
+    if value is None:
+        value = ""
+    elif not isinstance(value, str):
+        value = str(value)
+    encoded = value.encode("utf-8")
+    return _encode_varint(len(encoded)) + encoded
+
+
+def _encode_uuid(value):
+    """
+    Return a UUID as two little endian 64 bit integers, high half first.
+
+    xAPI event ids come as their 16 bytes, other ids as strings.
+    """
+    if isinstance(value, str):
+        value = uuid.UUID(value).bytes
+    return value[7::-1] + value[:7:-1]
+
+
+def _encode_datetime64(value):
+    # Emission times come as epoch seconds, stored as microsecond ticks
+    return struct.pack("<q", value * 1000000)
+
+
+def _encode_int32(value):
+    return struct.pack("<i", value)
+
+
+def _encode_bool(value):
+    return b"\x01" if value else b"\x00"
+
+
+_ENCODERS = {
+    "String": _encode_string,
+    "UUID": _encode_uuid,
+    "DateTime64(6, 'UTC')": _encode_datetime64,
+    "Int32": _encode_int32,
+    "Bool": _encode_bool,
+}
+
+
+def _get_encoder(clickhouse_type):
+    """
+    Return the binary encoder for a type, and whether it's Nullable.
+    """
+    if clickhouse_type.startswith("Nullable("):
+        return _ENCODERS[clickhouse_type[len("Nullable("):-1]], True
+    return _ENCODERS[clickhouse_type], False
+
+
+class TabSeparatedWriter:
+    """
+    Writes rows in the ClickHouse TabSeparated format.
+
+    Every value is written as its string, so the writer doesn't need the
+    column types.
+    """
+
+    typed_rows = False
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writerow(self, row):
+        """
+        Write a row, escaping any special characters in its values.
+        """
+        line = "\t".join(
+            "\\N" if v is None else (v if isinstance(v, str) else str(v)).translate(_TSV_ESCAPES)
+            for v in row
+        )
+        self.stream.write((line + "\n").encode("utf-8"))
+
+    def close(self):
+        """
+        Close the stream.
+        """
+        self.stream.close()
+
+
+class RowBinaryWriter:
+    """
+    Writes rows in the ClickHouse RowBinary format.
+
+    RowBinary files have no header, the structure from FILE_SCHEMAS has to be
+    given when loading them.
+    """
+
+    typed_rows = True
+
+    def __init__(self, stream, file_type):
+        self.stream = stream
+        self.encoders = [_get_encoder(ch_type) for _, ch_type in FILE_SCHEMAS[file_type]]
+
+    def writerow(self, row):
+        """
+        Write a row, each value in the binary encoding of its column type.
+        """
+        out = []
+        for value, (encode, nullable) in zip(row, self.encoders):
+            if nullable:
+                if value is None:
+                    out.append(b"\x01")
+                    continue
+                out.append(b"\x00")
+            out.append(encode(value))
+        self.stream.write(b"".join(out))
+
+    def close(self):
+        """
+        Close the stream.
+        """
+        self.stream.close()
+
+
+class NativeWriter:
+    """
+    Writes rows in the ClickHouse Native format.
+
+    Native files are a series of column oriented blocks, each with the
+    names and types of its columns, so they can be loaded without a
+    structure.
+    """
+
+    typed_rows = True
+
+    def __init__(self, stream, file_type):
+        self.stream = stream
+        self.schema = FILE_SCHEMAS[file_type]
+        self.encoders = [_get_encoder(ch_type) for _, ch_type in self.schema]
+        self.rows = []
+
+    def writerow(self, row):
+        """
+        Add a row, writing a block when there are enough rows.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= NATIVE_BLOCK_ROWS:
+            self._write_block()
+
+    def _write_block(self):
+        """
+        Write the buffered rows as a block.
+        """
+        out = [_encode_varint(len(self.schema)), _encode_varint(len(self.rows))]
+
+        for i, (name, ch_type) in enumerate(self.schema):
+            encode, nullable = self.encoders[i]
+            column = [row[i] for row in self.rows]
+            out.append(_encode_string(name))
+            out.append(_encode_string(ch_type))
+
+            if nullable:
+                # The null map comes first, then values with defaults in place of nulls
+                out.append(bytes(1 if v is None else 0 for v in column))
+                column = [0 if v is None else v for v in column]
+
+            out.extend(encode(v) for v in column)
+
+        self.stream.write(b"".join(out))
+        self.rows = []
+
+    def close(self):
+        """
+        Write any remaining rows and close the stream.
+        """
+        if self.rows:
+            self._write_block()
+        self.stream.close()
+
+
+# Writer class for each supported ClickHouse format other than CSV. Writers
+# with typed_rows take xAPI rows of (event_uuid, emission_epoch, event), the
+# id as 16 bytes and the time as epoch seconds, instead of strings.
+FORMAT_WRITERS = {
+    "TabSeparated": TabSeparatedWriter,
+    "RowBinary": RowBinaryWriter,
+    "Native": NativeWriter,
+}
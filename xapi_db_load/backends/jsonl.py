@@ -0,0 +1,60 @@
+"""
+JSON Lines Lake implementation.
+
+Writes xAPI statements exactly as they were generated, one per line, so they
+can be replayed into an LRS as many times as needed without regenerating
+them. The other event sink data is written as CSV, the same as the CSV
+backend, so it can still be loaded to ClickHouse.
+"""
+from xapi_db_load.backends.csv import XAPILakeCSV, get_file_handle, get_file_name, open_compressed_output
+
+
+class JSONLinesWriter:
+    """
+    Writes the statement from each xAPI row as a line of JSON.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writerow(self, row):
+        """
+        Write the statement, the last value of the (event_id, emission_time, event) row.
+        """
+        self.stream.write(row[-1].encode("utf-8") + b"\n")
+
+    def close(self):
+        """
+        Close the stream.
+        """
+        self.stream.close()
+
+
+def get_jsonl_handle(file_type, output_destination, handle_options=None, shard=None):
+    """
+    Open a JSON Lines file for xAPI statements, or a CSV file for anything else.
+
+    xAPI files are named like xapi_00001.jsonl.gz. Returns the file handle
+    and a writer for it, like get_file_handle.
+    """
+    if file_type != "xapi":
+        return get_file_handle(file_type, output_destination, handle_options, shard)
+
+    handle_options = handle_options or {}
+    writer = JSONLinesWriter(
+        open_compressed_output(
+            get_file_name(file_type, shard),
+            "jsonl",
+            output_destination,
+            handle_options.get("compression"),
+        )
+    )
+    return writer, writer
+
+
+class XAPILakeJSONL(XAPILakeCSV):
+    """
+    JSON Lines statement archive implementation.
+    """
+
+    open_handle = staticmethod(get_jsonl_handle)
@@ -0,0 +1,141 @@
+"""
+Parquet Lake implementation.
+
+Writes the same files as the CSV backend, but as Parquet, which is faster to
+write and much faster for ClickHouse to load. Requires pyarrow, which can be
+installed with the "parquet" extra: pip install xapi-db-load[parquet]
+"""
+import os
+
+from smart_open import open as smart
+
+from xapi_db_load.backends.csv import XAPILakeCSV, get_file_name
+from xapi_db_load.backends.schemas import FILE_SCHEMAS
+from xapi_db_load.utils import ConfigurationError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+
+def _get_arrow_type(clickhouse_type):
+    """
+    Return the Arrow type used to write a column of the given ClickHouse type.
+
+    UUIDs are written as strings, ClickHouse converts them on load.
+    """
+    if clickhouse_type.startswith("Nullable("):
+        clickhouse_type = clickhouse_type[len("Nullable("):-1]
+
+    if clickhouse_type.startswith("DateTime64"):
+        return pa.timestamp("us", tz="UTC")
+
+    return {
+        "String": pa.string(),
+        "UUID": pa.string(),
+        "Int32": pa.int32(),
+        "Bool": pa.bool_(),
+    }[clickhouse_type]
+
+
+def _to_arrow_array(values, arrow_type):
+    """
+    Convert a column of values as they are written to CSV to an Arrow array of the given type.
+    """
+    if pa.types.is_timestamp(arrow_type):
+        # Emission times are ISO strings, which Arrow can parse itself
+        return pa.array(values, pa.string()).cast(pa.timestamp("us")).cast(arrow_type)
+
+    if pa.types.is_string(arrow_type):
+        # Anything else (dates, datetimes) is written as its string value, the same as in CSV
+        values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+
+    return pa.array(values, arrow_type)
+
+
+class ParquetTableWriter:
+    """
+    Writes rows to a Parquet file, with a writerow method like a csv writer.
+
+    Rows are buffered and written as a row group whenever row_group_size rows
+    have been collected, and when the file is closed.
+    """
+
+    def __init__(self, out_filepath, schema, row_group_size, compression):
+        self.file_handle = smart(out_filepath, "wb", compression="disable")
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(self.file_handle, schema, compression=compression)
+        self.rows = []
+
+    def writerow(self, row):
+        """
+        Add a row to the file, writing a row group if there are enough rows.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        """
+        Write the buffered rows out as a row group.
+        """
+        columns = list(zip(*self.rows))
+        arrays = [_to_arrow_array(column, field.type) for column, field in zip(columns, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        """
+        Write any remaining rows and close the file.
+        """
+        if self.rows:
+            self._write_row_group()
+        self.writer.close()
+        self.file_handle.close()
+
+
+def get_parquet_handle(file_type, output_destination, parquet_options, shard=None):
+    """
+    Open a Parquet file for writing, returning the file handle and a writer for it.
+
+    Both are the same ParquetTableWriter, to match get_file_handle.
+    """
+    out_filepath = os.path.join(output_destination, f"{get_file_name(file_type, shard)}.parquet")
+    os.makedirs(output_destination, exist_ok=True)
+
+    schema = pa.schema([(name, _get_arrow_type(ch_type)) for name, ch_type in FILE_SCHEMAS[file_type]])
+    writer = ParquetTableWriter(
+        out_filepath,
+        schema,
+        parquet_options["row_group_size"],
+        parquet_options["compression"],
+    )
+    return writer, writer
+
+
+class XAPILakeParquet(XAPILakeCSV):
+    """
+    Parquet fake data lake implementation.
+    """
+
+    open_handle = staticmethod(get_parquet_handle)
+
+    def __init__(self, config):
+        if pa is None:
+            raise ConfigurationError(
+                "The parquet_file backend requires pyarrow, install it with: pip install xapi-db-load[parquet]"
+            )
+        super().__init__(config)
+
+    def get_handle_options(self, config):
+        """
+        Return the row group size and compression used for every Parquet file.
+        """
+        return {
+            "row_group_size": config.get("parquet_row_group_size", 100000),
+            "compression": config.get("parquet_compression", "zstd"),
+        }
@@ -0,0 +1,146 @@
+"""
+Progress monitoring for long running ClickHouse queries.
+
+Server side loads like INSERT ... SELECT FROM s3(...) don't report anything
+back to the client until they finish, so this polls system.processes for
+them from another thread and connection.
+"""
+import threading
+
+import clickhouse_connect
+
+from xapi_db_load.utils import log_duration
+
+
+def format_eta(seconds):
+    """
+    Return a number of seconds as H:MM:SS, or "unknown".
+    """
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+class QueryProgressMonitor:
+    """
+    Polls system.processes for the queries it's watching, printing and logging their progress.
+
+    Queries are watched by query_id, add them with watch() before starting
+    them and remove them with unwatch() when they are done. Distributed
+    queries (ex: s3Cluster) are summed over all of the queries they started.
+    """
+
+    def __init__(self, client, interval, cluster=None):
+        self.client = client
+        self.interval = interval
+        # Queries distributed over a cluster run on every node
+        self.processes_table = "system.processes"
+        if cluster:
+            self.processes_table = f"clusterAllReplicas('{cluster}', system.processes)"
+        self.queries = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Start polling in a background thread.
+        """
+        self.thread = threading.Thread(target=self._run, name="query_progress", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop polling and wait for the thread to finish.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def watch(self, query_id, timer_key, description):
+        """
+        Start reporting on a query, logged with the given timer key.
+        """
+        with self.lock:
+            self.queries[query_id] = (timer_key, description)
+
+    def unwatch(self, query_id):
+        """
+        Stop reporting on a query.
+        """
+        with self.lock:
+            self.queries.pop(query_id, None)
+
+    def _run(self):
+        """
+        Poll every interval seconds until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except clickhouse_connect.driver.exceptions.Error as e:
+                # Monitoring is best effort, it shouldn't stop the load
+                print(f"   Unable to get query progress: {e}")
+
+    def poll(self):
+        """
+        Print and log the current progress of each watched query that is still running.
+        """
+        with self.lock:
+            queries = dict(self.queries)
+        if not queries:
+            return
+
+        res = self.client.query(
+            f"""
+            SELECT
+                initial_query_id,
+                max(elapsed),
+                sum(read_rows),
+                sum(read_bytes),
+                sum(total_rows_approx),
+                sum(written_rows),
+                sum(written_bytes),
+                sum(memory_usage)
+            FROM {self.processes_table}
+            WHERE initial_query_id IN {{query_ids:Array(String)}}
+            GROUP BY initial_query_id
+            """,
+            parameters={"query_ids": list(queries)},
+        )
+
+        for row in res.result_set:
+            query_id, elapsed, read_rows, read_bytes, total_rows, written_rows, written_bytes, memory = row
+            if query_id not in queries:
+                continue
+            timer_key, description = queries[query_id]
+
+            rows_per_second = read_rows / elapsed if elapsed else None
+            eta = None
+            if rows_per_second and total_rows > read_rows:
+                eta = (total_rows - read_rows) / rows_per_second
+
+            log_duration(
+                "query_progress",
+                timer_key,
+                elapsed,
+                query_id=query_id,
+                read_rows=read_rows,
+                read_bytes=read_bytes,
+                total_rows_approx=total_rows,
+                written_rows=written_rows,
+                written_bytes=written_bytes,
+                memory_usage=memory,
+                rows_per_second=rows_per_second,
+                bytes_per_second=read_bytes / elapsed if elapsed else None,
+                eta_seconds=eta,
+            )
+            print(
+                f"   {description}: {read_rows:,} rows read ({rows_per_second or 0:,.0f}/s, "
+                f"{read_bytes / elapsed / 1024 / 1024 if elapsed else 0:,.1f} MiB/s), "
+                f"{written_rows:,} written, {memory / 1024 / 1024:,.0f} MiB memory, ETA {format_eta(eta)}",
+                flush=True,
+            )
@@ -4,7 +4,11 @@ Lake implementation for the Ralph LRS.
 Currently only supports the ClickHouse Ralph backend, but older versions of this file supported Mongo.
 """
 import datetime
+import gzip
+import itertools
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
@@ -30,27 +34,163 @@ class XAPILRSRalphClickhouse(XAPILakeClickhouse):
     Wraps the XAPILakeClickhouse backend so that queries can be run against it while using Ralph to do the insertion.
     """
 
+    lrs_executor = None
+
     def __init__(self, config):
         super().__init__(config)
-        self.lrs_url = config["lrs_url"]
+        # lrs_url can be a single URL or a list of them to round-robin across
+        lrs_urls = config["lrs_url"]
+        self.lrs_urls = [lrs_urls] if isinstance(lrs_urls, str) else list(lrs_urls)
+        self.lrs_url_cycle = itertools.cycle(self.lrs_urls)
         self.lrs_username = config["lrs_username"]
         self.lrs_password = config["lrs_password"]
+        self.lrs_timeout = config.get("lrs_timeout", 60)
+        self.lrs_concurrency = config.get("lrs_concurrency", 1)
+        self.lrs_compression = config.get("lrs_compression")
+        if self.lrs_compression not in (None, "gzip"):
+            raise ValueError(f"Unsupported lrs_compression {self.lrs_compression}, only gzip is supported.")
+
+        # Sessions keep connections to Ralph alive between requests, each
+        # sending thread gets its own since they aren't guaranteed thread safe.
+        self.sessions = threading.local()
+
+        # The pool of sending threads, started by the first batch when
+        # lrs_concurrency is more than 1
+        self.lrs_slots = None
+        self.lrs_futures = []
+        self.lrs_errors = []
 
     def batch_insert(self, events):
         """
         POST a batch of rows to Ralph.
+        """
+        self.send_statements([x["event"] for x in events])
+
+    def send_statements(self, statements):
+        """
+        POST a batch of already serialized statements to Ralph.
+
+        Statements can be str or, when read straight from a file, bytes. If
+        lrs_concurrency is greater than 1 the POST is sent from a pool of
+        threads and this returns as soon as there is room for it, finalize()
+        waits for all outstanding requests.
+        """
+        url = next(self.lrs_url_cycle)
+        if self.lrs_concurrency > 1:
+            self._submit_concurrent_post(url, statements)
+        else:
+            self._post_statements(url, statements)
+
+    def _get_session(self):
+        """
+        Return the requests Session for the current thread.
+        """
+        session = getattr(self.sessions, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.auth = (self.lrs_username, self.lrs_password)
+            session.headers.update({"Content-Type": "application/json"})
+            self.sessions.session = session
+        return session
 
-        Ralph wants one json object per line, not an array of objects.
+    def _post_statements(self, url, statements):
         """
-        out_data = [json.loads(x["event"]) for x in events]
-        resp = requests.post(  # pylint: disable=missing-timeout
-            self.lrs_url,
-            auth=(self.lrs_username, self.lrs_password),
-            json=out_data,
-            headers={"Content-Type": "application/json"},
+        POST a batch of serialized statements to the given Ralph URL.
+
+        The statements are joined into a JSON array as-is instead of being
+        parsed and dumped again.
+        """
+        if statements and isinstance(statements[0], bytes):
+            statement_array = b"[" + b",".join(statements) + b"]"
+        else:
+            statement_array = ("[" + ",".join(statements) + "]").encode("utf-8")
+
+        body = statement_array
+        headers = None
+        if self.lrs_compression == "gzip":
+            body = gzip.compress(body, compresslevel=1)
+            headers = {"Content-Encoding": "gzip"}
+
+        resp = self._get_session().post(
+            url,
+            data=body,
+            headers=headers,
+            timeout=self.lrs_timeout,
         )
         try:
             resp.raise_for_status()
         except requests.HTTPError:
-            print(json.dumps(out_data))
+            print(statement_array.decode("utf-8"))
             raise
+
+    def _submit_concurrent_post(self, url, statements):
+        """
+        Queue a batch to be POSTed by the next free sending thread.
+        """
+        if self.lrs_executor is None:
+            print(f"Sending to Ralph with {self.lrs_concurrency} concurrent requests")
+            self.lrs_executor = ThreadPoolExecutor(
+                max_workers=self.lrs_concurrency,
+                thread_name_prefix="ralph_sender",
+            )
+            # Allow one waiting batch per thread so the senders never sit
+            # idle, but generation can't get too far ahead of them.
+            self.lrs_slots = threading.BoundedSemaphore(self.lrs_concurrency * 2)
+            self.lrs_futures = []
+            self.lrs_errors = []
+
+        # Fail fast if a previous request failed
+        if self.lrs_errors:
+            raise self.lrs_errors[0]
+
+        self.lrs_slots.acquire()  # pylint: disable=consider-using-with
+        future = self.lrs_executor.submit(self._post_statements, url, statements)
+        future.add_done_callback(self._concurrent_post_done)
+        self.lrs_futures = [f for f in self.lrs_futures if not f.done()]
+        self.lrs_futures.append(future)
+
+    def _concurrent_post_done(self, future):
+        """
+        Free up the slot for a finished request and keep any error for the main thread.
+        """
+        self.lrs_slots.release()
+        if future.exception():
+            self.lrs_errors.append(future.exception())
+
+    def flush(self):
+        """
+        Wait for every batch sent so far to be accepted by Ralph.
+        """
+        if self.lrs_executor is not None:
+            for future in self.lrs_futures:
+                # Errors are collected by the done callback
+                future.exception()
+
+            if self.lrs_errors:
+                raise self.lrs_errors[0]
+
+        super().flush()
+
+    def abort(self):
+        """
+        Drop any requests to Ralph that haven't started after a failed run.
+        """
+        if self.lrs_executor is not None:
+            self.lrs_executor.shutdown(wait=False, cancel_futures=True)
+            self.lrs_executor = None
+
+    def finalize(self):
+        """
+        Wait for any outstanding requests to Ralph to finish.
+        """
+        if self.lrs_executor is not None:
+            for future in self.lrs_futures:
+                # Errors are collected by the done callback
+                future.exception()
+            self.lrs_executor.shutdown()
+            self.lrs_executor = None
+
+            if self.lrs_errors:
+                raise self.lrs_errors[0]
+
+        super().finalize()
@@ -0,0 +1,112 @@
+"""
+Column schemas for the files written by the file backends.
+
+Each file type lists its columns in the order the backends write them, with
+the ClickHouse type of the data as it is written to the file. These don't
+always match the types of the ClickHouse tables, ClickHouse converts them
+when the files are loaded.
+"""
+
+# File extension for each ClickHouse format the file backends can write,
+# compressed formats get the compression extension added.
+FILE_FORMAT_EXTENSIONS = {
+    "CSV": "csv",
+    "TabSeparated": "tsv",
+    "RowBinary": "rowbinary",
+    "Native": "native",
+    "Parquet": "parquet",
+}
+
+# Types of the "dump_id" and "time_last_dumped" columns that end each event sink table
+_DUMP_COLUMNS = (
+    ("dump_id", "UUID"),
+    ("time_last_dumped", "String"),
+)
+
+FILE_SCHEMAS = {
+    "xapi": (
+        ("event_id", "UUID"),
+        ("emission_time", "DateTime64(6, 'UTC')"),
+        ("event", "String"),
+    ),
+    "courses": (
+        ("org", "String"),
+        ("course_key", "String"),
+        ("display_name", "String"),
+        ("course_start", "String"),
+        ("course_end", "String"),
+        ("enrollment_start", "String"),
+        ("enrollment_end", "String"),
+        ("self_paced", "Bool"),
+        ("course_data_json", "String"),
+        ("created", "String"),
+        ("modified", "String"),
+    ) + _DUMP_COLUMNS,
+    "blocks": (
+        ("org", "String"),
+        ("course_key", "String"),
+        ("location", "String"),
+        ("display_name", "String"),
+        ("xblock_data_json", "String"),
+        ("order", "Int32"),
+        ("edited_on", "String"),
+    ) + _DUMP_COLUMNS,
+    "external_ids": (
+        ("external_user_id", "UUID"),
+        ("external_id_type", "String"),
+        ("username", "String"),
+        ("user_id", "Int32"),
+    ) + _DUMP_COLUMNS,
+    "user_profiles": (
+        ("id", "Int32"),
+        ("user_id", "Int32"),
+        ("name", "String"),
+        ("username", "String"),
+        ("email", "String"),
+        ("meta", "String"),
+        ("courseware", "String"),
+        ("language", "String"),
+        ("location", "String"),
+        ("year_of_birth", "Int32"),
+        ("gender", "String"),
+        ("level_of_education", "String"),
+        ("mailing_address", "String"),
+        ("city", "String"),
+        ("country", "String"),
+        ("state", "String"),
+        ("goals", "String"),
+        ("bio", "String"),
+        ("profile_image_uploaded_at", "String"),
+        ("phone_number", "String"),
+    ) + _DUMP_COLUMNS,
+    "taxonomies": (
+        ("id", "Int32"),
+        ("name", "String"),
+    ) + _DUMP_COLUMNS,
+    "tags": (
+        ("id", "Int32"),
+        ("taxonomy", "Int32"),
+        ("parent", "Nullable(Int32)"),
+        ("value", "String"),
+        ("external_id", "String"),
+        ("lineage", "String"),
+    ) + _DUMP_COLUMNS,
+    "object_tags": (
+        ("id", "Int32"),
+        ("object_id", "String"),
+        ("taxonomy", "Int32"),
+        ("tag", "Int32"),
+        ("value", "String"),
+        ("export_id", "String"),
+        ("lineage", "String"),
+    ) + _DUMP_COLUMNS,
+}
+
+
+def get_structure(file_type):
+    """
+    Return the ClickHouse structure string for a file type, ex: "`event_id` UUID, ...".
+
+    This is needed to load formats that don't describe their own columns.
+    """
+    return ", ".join(f"`{name}` {ch_type}" for name, ch_type in FILE_SCHEMAS[file_type])
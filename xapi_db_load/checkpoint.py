@@ -0,0 +1,166 @@
+"""
+Checkpoints for resuming interrupted runs.
+
+A checkpoint file records the random seed and settings used to build the
+EventGenerator, which phases of the run have finished and how many batches are known to be
+committed to the backend. A run started with --resume rebuilds the same
+courses and actors from the seed, skips the finished phases and carries on
+from the next batch.
+"""
+import json
+import os
+import random
+
+from xapi_db_load.utils import ConfigurationError
+
+# Default number of batches between checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 100
+
+# Settings that change what is generated from a seed, a run can only be
+# resumed if they are the same as when it started.
+GENERATION_SETTINGS = (
+    "batch_size",
+    "num_actors",
+    "num_organizations",
+    "num_course_sizes",
+    "course_size_makeup",
+    "course_length_days",
+    "start_date",
+    "end_date",
+)
+
+
+def get_generation_settings(config):
+    """
+    Return the GENERATION_SETTINGS of the config, as they are saved in the checkpoint file.
+    """
+    # Dates are saved as strings, round trip everything so it compares the same as a loaded file
+    return json.loads(json.dumps({key: config.get(key) for key in GENERATION_SETTINGS}, default=str))
+
+
+def get_checkpoint_path(config):
+    """
+    Return the configured checkpoint file, by default checkpoint.json in log_dir.
+
+    Returns None if there is nowhere to write one.
+    """
+    if config.get("checkpoint_file"):
+        return config["checkpoint_file"]
+    if config.get("log_dir"):
+        return os.path.join(config["log_dir"], "checkpoint.json")
+    return None
+
+
+class Checkpoint:
+    """
+    The progress of a run, saved to a JSON file as it changes.
+    """
+
+    def __init__(self, path, seed, settings, num_batches, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.seed = seed
+        self.settings = settings
+        self.num_batches = num_batches
+        self.interval = interval
+        self.completed_phases = []
+        self.batches_completed = 0
+
+    @classmethod
+    def start(cls, config):
+        """
+        Return a new checkpoint for a run of the given config.
+
+        The run's seed is taken from the config if it has one, otherwise one
+        is picked here so the run can be rebuilt.
+        """
+        seed = config.get("seed")
+        if seed is None:
+            seed = random.SystemRandom().randrange(2 ** 32)
+
+        checkpoint = cls(
+            get_checkpoint_path(config),
+            seed,
+            get_generation_settings(config),
+            config["num_batches"],
+            config.get("checkpoint_interval", DEFAULT_CHECKPOINT_INTERVAL),
+        )
+        checkpoint.save()
+        return checkpoint
+
+    @classmethod
+    def resume(cls, config):
+        """
+        Load the checkpoint of an interrupted run of the given config.
+        """
+        path = get_checkpoint_path(config)
+        if not path or not os.path.exists(path):
+            raise ConfigurationError(f"Can't resume, no checkpoint file found at {path}.")
+
+        with open(path, "r") as f:
+            saved = json.load(f)
+
+        settings = get_generation_settings(config)
+        for key in GENERATION_SETTINGS:
+            if saved["settings"].get(key) != settings[key]:
+                raise ConfigurationError(
+                    f"Can't resume, the checkpoint has a {key} of {saved['settings'].get(key)} "
+                    f"but the config has {settings[key]}."
+                )
+
+        checkpoint = cls(
+            path,
+            saved["seed"],
+            saved["settings"],
+            config["num_batches"],
+            config.get("checkpoint_interval", DEFAULT_CHECKPOINT_INTERVAL),
+        )
+        checkpoint.completed_phases = saved["completed_phases"]
+        checkpoint.batches_completed = saved["batches_completed"]
+        return checkpoint
+
+    def save(self):
+        """
+        Write the checkpoint file, replacing the old one in one step so it's never left half written.
+        """
+        if not self.path:
+            return
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "seed": self.seed,
+                    "settings": self.settings,
+                    "num_batches": self.num_batches,
+                    "completed_phases": self.completed_phases,
+                    "batches_completed": self.batches_completed,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    def phase_done(self, phase):
+        """
+        Return True if the given phase finished in an earlier run.
+        """
+        return phase in self.completed_phases
+
+    def complete_phase(self, phase):
+        """
+        Record that a phase has finished.
+        """
+        self.completed_phases.append(phase)
+        self.save()
+
+    def is_due(self, batches_completed):
+        """
+        Return True if a checkpoint should be saved after the given number of batches.
+        """
+        return batches_completed % self.interval == 0 or batches_completed == self.num_batches
+
+    def complete_batches(self, batches_completed):
+        """
+        Record that every batch up to batches_completed is committed to the backend.
+        """
+        self.batches_completed = batches_completed
+        self.save()
@@ -0,0 +1,133 @@
+"""
+Block compression of output files across multiple threads.
+
+The stream is split into blocks which are each compressed on their own, as
+concatenated gzip members (like pigz) or zstd frames, and written out in
+order. Both gzip and zstd readers treat the result as a single stream.
+"""
+import gzip
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import zstandard
+from smart_open import open as smart
+
+# File extension used for each supported compression type
+COMPRESSION_EXTENSIONS = {
+    "gzip": "gz",
+    "zstd": "zst",
+}
+
+DEFAULT_LEVELS = {
+    # The same as smart_open and the gzip module
+    "gzip": 9,
+    "zstd": 3,
+}
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_compressor(compression, level=None):
+    """
+    Return a function that compresses one block of bytes into a complete gzip member or zstd frame.
+    """
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression {compression}, must be one of {list(COMPRESSION_EXTENSIONS)}.")
+
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+
+    if compression == "gzip":
+        return lambda block: gzip.compress(block, compresslevel=level, mtime=0)
+
+    # ZstdCompressor instances can't be shared between threads, but they are
+    # cheap to make.
+    return lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+
+
+class BlockCompressingWriter(io.RawIOBase):
+    """
+    Binary file-like object that compresses everything written to it in blocks.
+
+    Blocks are compressed in a pool of threads (zlib and zstd both release
+    the GIL while compressing) and written to the output file in order. With
+    one thread blocks are compressed inline.
+    """
+
+    def __init__(self, output, compression="gzip", level=None, threads=1, block_size=DEFAULT_BLOCK_SIZE):
+        super().__init__()
+        self.output = output
+        self.compress = get_compressor(compression, level)
+        self.block_size = block_size
+        self.buffer = bytearray()
+
+        self.executor = None
+        self.pending = deque()
+        # Keep a couple of blocks per thread in flight, any more just uses memory
+        self.max_pending = threads * 2
+        if threads > 1:
+            self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="compression")
+
+    def writable(self):
+        """
+        Tell io wrappers that this stream can be written to.
+        """
+        return True
+
+    def write(self, b):
+        """
+        Buffer the given bytes, compressing full blocks as they fill up.
+        """
+        self.buffer += b
+        while len(self.buffer) >= self.block_size:
+            self._compress_block(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(b)
+
+    def _compress_block(self, block):
+        """
+        Compress a block, writing out any finished blocks in order.
+        """
+        if self.executor is None:
+            self.output.write(self.compress(block))
+            return
+
+        self.pending.append(self.executor.submit(self.compress, block))
+        while self.pending and (len(self.pending) >= self.max_pending or self.pending[0].done()):
+            self.output.write(self.pending.popleft().result())
+
+    def close(self):
+        """
+        Compress and write out anything left, then close the output file.
+        """
+        if self.closed:
+            return
+
+        try:
+            if self.buffer:
+                self._compress_block(bytes(self.buffer))
+                self.buffer.clear()
+
+            while self.pending:
+                self.output.write(self.pending.popleft().result())
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.output.close()
+            super().close()
+
+
+def open_compressed_input(path):
+    """
+    Open a gzip or zstd compressed file for reading, based on its extension.
+
+    Returns a binary file object that reads across all of the blocks written
+    by BlockCompressingWriter, which can be iterated by line.
+    """
+    if path.endswith(f".{COMPRESSION_EXTENSIONS['zstd']}"):
+        # zstd readers stop after the first frame by default
+        raw = smart(path, "rb", compression="disable")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True))
+
+    return smart(path, "rb")
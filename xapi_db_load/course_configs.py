@@ -5,54 +5,125 @@ import copy
 import datetime
 import json
 import random
-import uuid
 from collections import namedtuple
-from random import choice, randrange
+from itertools import chain
 
-EnrolledActor = namedtuple("Actor", ["actor", "enroll_datetime"])
+import numpy as np
 
+from xapi_db_load.ids import uuid4_array, uuid4_strings
+from xapi_db_load.timestamps import SECONDS_PER_DAY, date_to_epoch
+from xapi_db_load.xapi.xapi_common import encode_string
 
-class Actor:
+# One enrollment of an actor in a course, made on demand from the course's
+# enrollment arrays. actor_id is the external id UUID string of the actor,
+# emission_start is the epoch seconds of the start of the day the actor
+# enrolled, emission_window is the number of seconds from then until the end
+# of the course.
+EnrolledActor = namedtuple("EnrolledActor", ["actor_id", "emission_start", "emission_window"])
+
+
+class ActorStore:
     """
-    Wrapper for actor PII data.
+    Column oriented store of actor PII data.
 
     These are a combination of fields from edx-platform UserProfile and
     ExternalId models. These fields are largely unpopulated in real life,
     especially after the introduction of the profile MFE, but operators have
     the capability to fill them in various ways.
+
+    Actors are identified by their integer user id, just the counter from
+    actor population, and only the fields that are random are stored: the
+    external id UUIDs and a small integer per actor for each of the others.
+    Everything else is derived from the user id when it's needed, so
+    millions of actors only take tens of MB.
     """
 
-    def __init__(self, user_id):
-        # Integer user id, just the counter from actor population
-        self.user_id = user_id
+    # Choices for the categorical fields, actors store an index into these
+    GENDERS = ("", "m", "f", "o")
+    LEVELS_OF_EDUCATION = ("", "p", "m", "b", "none", "other")
+    COUNTRIES = ("", "US", "CO", "AU", "IN", "PK")
 
-        # "external_id" UUID
-        self.id = str(uuid.uuid4())
+    def __init__(self, num_actors, rng):
+        """
+        Create num_actors actors, using the given numpy random generator.
+        """
+        self.num_actors = num_actors
 
-        # LMS username
-        self.username = f"actor_{self.user_id}"
+        # "external_id" UUIDs
+        self.ids = uuid4_array(num_actors, rng.bytes)
 
         # These may or may not ever be populated in real life, potentially
         # useful values are populated here.
-        self.name = f"Actor {user_id}"
-        self.year_of_birth = random.randint(1900, 2010)
-        self.gender = random.choice(["", "m", "f", "o"])
-        self.level_of_education = random.choice(["", "p", "m", "b", "none", "other"])
-        self.country = random.choice(["", "US", "CO", "AU", "IN", "PK"])
-        self.goals = ""
-        self.bio = ""
-
-        # These will probably never be populated, and aren't expected to be used
-        # but are part of the event sink and table
-        self.meta = "{}"
-        self.courseware = ""
-        self.language = ""
-        self.location = ""
-        self.mailing_address = ""
-        self.city = ""
-        self.state = ""
-        self.profile_image_uploaded_at = ""
-        self.phone_number = ""
+        self.years_of_birth = rng.integers(1900, 2011, size=num_actors, dtype=np.int16)
+        self.genders = rng.integers(len(self.GENDERS), size=num_actors, dtype=np.uint8)
+        self.levels_of_education = rng.integers(len(self.LEVELS_OF_EDUCATION), size=num_actors, dtype=np.uint8)
+        self.countries = rng.integers(len(self.COUNTRIES), size=num_actors, dtype=np.uint8)
+
+    def __len__(self):
+        return self.num_actors
+
+    def get_id(self, user_id):
+        """
+        Return the external id UUID string of an actor.
+        """
+        return self.ids[user_id].decode("ascii")
+
+    @staticmethod
+    def get_username(user_id):
+        """
+        Return the LMS username of an actor.
+        """
+        return f"actor_{user_id}"
+
+    def external_id_rows(self):
+        """
+        Yield the external_id, external_id_type, username and user_id of each actor.
+        """
+        for user_id, actor_id in enumerate(self.ids.tolist()):
+            yield actor_id.decode("ascii"), "xapi", self.get_username(user_id), user_id
+
+    def profile_rows(self):
+        """
+        Yield the user_profile values of each actor, in the order of the event sink table.
+
+        The first value is usually the MySQL row pk, the user id is used to
+        have a unique id.
+        """
+        for user_id, year_of_birth, gender, level_of_education, country in zip(
+            range(self.num_actors),
+            self.years_of_birth.tolist(),
+            self.genders.tolist(),
+            self.levels_of_education.tolist(),
+            self.countries.tolist(),
+        ):
+            username = self.get_username(user_id)
+            yield (
+                user_id,
+                user_id,
+                f"Actor {user_id}",  # name
+                username,
+                f"{username}@aspects.invalid",  # email
+                # meta, courseware, language and location will probably
+                # never be populated, and aren't expected to be used but are
+                # part of the event sink and table
+                "{}",
+                "",
+                "",
+                "",
+                year_of_birth,
+                self.GENDERS[gender],
+                self.LEVELS_OF_EDUCATION[level_of_education],
+                # mailing_address, city
+                "",
+                "",
+                self.COUNTRIES[country],
+                # state, goals, bio, profile_image_uploaded_at, phone_number
+                "",
+                "",
+                "",
+                "",
+                "",
+            )
 
 
 class RandomCourse:
@@ -67,10 +138,13 @@ class RandomCourse:
     problem_ids = []
     video_ids = []
     forum_post_ids = []
-    actors = []
-    all_tags = []
+    actors = None
+    enrolled_user_ids = None
+    enrollment_starts = None
+    block_data = None
     start_date = None
     end_date = None
+    self_paced = False
 
     def __init__(
         self,
@@ -80,11 +154,20 @@ class RandomCourse:
         overall_start_date,
         overall_end_date,
         course_length,
-        actors,
+        enrolled_user_ids,
         course_config_name,
         course_size_makeup,
-        tags
+        tags,
+        rng,
+        actors=None
     ):
+        """
+        Build the course, drawing all of its random values from the numpy Generator rng.
+
+        Courses only depend on their own arguments, so they can be built in
+        other processes. actors is the ActorStore that enrolled_user_ids
+        index into, it can also be attached after the course is built.
+        """
         self.course_uuid = course_uuid
         self.course_run = course_run
         # It's important that the course name stay the same between runs
@@ -96,18 +179,33 @@ class RandomCourse:
         self.course_url = f"http://localhost:18000/course/{self.course_id}"
 
         delta = datetime.timedelta(days=course_length)
-        self.start_date = self._random_datetime(overall_start_date, overall_end_date - delta)
+        self.start_date = self._random_datetime(rng, overall_start_date, overall_end_date - delta)
         self.end_date = self.start_date + delta
 
-        self.actors = [
-            EnrolledActor(a, self._random_datetime(self.start_date, self.end_date))
-            for a in actors
-        ]
+        # Events can be emitted through the end of the last day of the course
+        self.emission_end = date_to_epoch(self.end_date) + SECONDS_PER_DAY
+
+        # Enrollments are kept as parallel arrays of the user id of each
+        # enrolled actor in the ActorStore and the epoch seconds of the day
+        # they enrolled, rather than an object per enrollment, as there can
+        # be millions of them.
+        self.actors = actors
+        self.enrolled_user_ids = np.asarray(enrolled_user_ids, dtype=np.int32)
+        enrollment_days = rng.integers(course_length, size=len(self.enrolled_user_ids))
+        self.enrollment_starts = date_to_epoch(self.start_date) + enrollment_days * SECONDS_PER_DAY
 
         self.course_config_name = course_config_name
         self.course_config = course_size_makeup
-        self.all_tags = tags
-        self.configure()
+        self.configure(tags, rng)
+        self.self_paced = bool(rng.integers(2))
+
+        # JSON fragments that are the same in every statement about this course
+        (
+            self.course_url_json,
+            self.parent_activities_json,
+            self.course_object_json,
+            self.ids_json,
+        ) = self._serialize_statement_fragments()
 
     def __repr__(self):
         return f"""{self.course_name}:
@@ -115,64 +213,90 @@ class RandomCourse:
         {self.course_config}
         """
 
-    def configure(self):
+    def configure(self, tags, rng):
         """
         Set up the fake course configuration such as course length, start and end dates, and size.
+
+        The block structure is serialized here too, once, so that every
+        backend and publish gets the same blocks.
         """
-        self.chapter_ids = [
-            self._generate_random_block_type_id("chapter")
-            for _ in range(self.course_config["chapters"])
-        ]
+        self.chapter_ids = self._generate_random_block_type_ids("chapter", self.course_config["chapters"], rng)
+        self.sequential_ids = self._generate_random_block_type_ids("sequential", self.course_config["sequences"], rng)
+        self.vertical_ids = self._generate_random_block_type_ids("vertical", self.course_config["verticals"], rng)
+        self.problem_ids = self._generate_random_block_type_ids("problem", self.course_config["problems"], rng)
+        self.video_ids = self._generate_random_block_type_ids("video", self.course_config["videos"], rng)
+        self.forum_post_ids = self._generate_random_forum_post_ids(self.course_config["forum_posts"], rng)
 
-        self.sequential_ids = [
-            self._generate_random_block_type_id("sequential")
-            for _ in range(self.course_config["sequences"])
-        ]
+        for config in ("videos", "problems", "verticals", "sequences", "chapters", "forum_posts"):
+            self.items_in_course += self.course_config[config]
 
-        self.vertical_ids = [
-            self._generate_random_block_type_id("vertical")
-            for _ in range(self.course_config["verticals"])
-        ]
+        self.block_data = self._serialize_block_data(tags, rng)
 
-        self.problem_ids = [
-            self._generate_random_block_type_id("problem")
-            for _ in range(self.course_config["problems"])
-        ]
-
-        self.video_ids = [
-            self._generate_random_block_type_id("video")
-            for _ in range(self.course_config["videos"])
-        ]
+    def _serialize_statement_fragments(self):
+        """
+        Pre-serialize the JSON fragments that are the same in every statement about this course.
 
-        self.forum_post_ids = [
-            self._generate_random_forum_post_id()
-            for _ in range(self.course_config["forum_posts"])
-        ]
+        The xAPI event classes splice these into their statement templates
+        instead of encoding them again for every statement. Returns the
+        course url, the contextActivities "parent" list, the statement
+        "object" when the course itself is the object, and a dict of the
+        JSON encoded version of each id in the course keyed by the id.
+        """
+        parent_activities_json = json.dumps([
+            {
+                "id": self.course_url,
+                "objectType": "Activity",
+                "definition": {
+                    "name": {"en-US": "Demonstration Course"},
+                    "type": "http://adlnet.gov/expapi/activities/course",
+                },
+            }
+        ])
+
+        course_object_json = json.dumps({
+            "id": self.course_url,
+            "definition": {
+                "name": {"en": "Demonstration Course"},
+                "type": "http://adlnet.gov/expapi/activities/course",
+            },
+            "objectType": "Activity",
+        })
+
+        ids_json = {
+            object_id: encode_string(object_id)
+            for object_id in chain(
+                self.chapter_ids,
+                self.sequential_ids,
+                self.vertical_ids,
+                self.problem_ids,
+                self.video_ids,
+                self.forum_post_ids,
+            )
+        }
 
-        for config in ("videos", "problems", "verticals", "sequences", "chapters", "forum_posts"):
-            self.items_in_course += self.course_config[config]
+        return encode_string(self.course_url), parent_activities_json, course_object_json, ids_json
 
-    def get_random_emission_time(self, actor=None):
+    def get_random_emission_time(self, actor=None, draw=None, rand=random):
         """
         Randomizes an emission time for events that falls within the course start and end dates.
+
+        Returns integer epoch seconds. If given, draw is a random float in
+        [0, 1) used to pick the time, otherwise it's drawn from rand, a
+        random.Random or the random module.
         """
         if actor:
-            start = actor.enroll_datetime
+            start = actor.emission_start
+            window = actor.emission_window
         else:
-            start = self.start_date
-
-        # Make sure we're passing in a datetime, not a date
-        start = datetime.datetime.combine(start, datetime.time())
+            start = date_to_epoch(self.start_date)
+            window = self.emission_end - start
 
-        # time() is midnight, so make sure we get that last day in there
-        end = datetime.datetime.combine(self.end_date, datetime.time()) + datetime.timedelta(days=1)
-
-        return self._random_datetime(
-            start_datetime=start, end_datetime=end
-        )
+        if draw is None:
+            return start + rand.randrange(window)
+        return start + int(draw * window)
 
     @staticmethod
-    def _random_datetime(start_datetime=None, end_datetime=None):
+    def _random_datetime(rng, start_datetime=None, end_datetime=None):
         """
         Create a random datetime within the given boundaries.
 
@@ -186,52 +310,98 @@ class RandomCourse:
 
         delta = end_datetime - start_datetime
         int_delta = (delta.days * 24 * 60 * 60) + delta.seconds
-        random_second = randrange(int_delta)
+        random_second = int(rng.integers(int_delta))
         return start_datetime + datetime.timedelta(seconds=random_second)
 
-    def get_enrolled_actor(self):
+    def get_enrollment(self, index):
         """
-        Return an actor from those known in this course.
+        Return the EnrolledActor for the enrollment at the given index.
         """
-        return choice(self.actors)
+        emission_start = int(self.enrollment_starts[index])
+        return EnrolledActor(
+            self.actors.get_id(self.enrolled_user_ids[index]),
+            emission_start,
+            self.emission_end - emission_start,
+        )
 
-    def get_video_id(self):
+    def get_enrollments(self):
         """
-        Return a video id from our list of known video ids.
+        Yield an EnrolledActor for every enrollment in this course, in order.
         """
-        return choice(self.video_ids)
+        actor_ids = self.actors.ids[self.enrolled_user_ids]
+        for actor_id, emission_start in zip(actor_ids.tolist(), self.enrollment_starts.tolist()):
+            yield EnrolledActor(actor_id.decode("ascii"), emission_start, self.emission_end - emission_start)
 
-    def _generate_random_block_type_id(self, block_type):
-        block_uuid = str(uuid.uuid4())[:8]
-        return f"http://localhost:18000/xblock/block-v1:{self.course_id}+type@{block_type}+block@{block_uuid}"
+    def get_enrolled_actor(self, draw=None, rand=random):
+        """
+        Return an enrollment from those in this course.
 
-    def get_problem_id(self):
+        If given, draw is a random non-negative integer used to pick the
+        enrollment, otherwise it's drawn from rand.
+        """
+        num_enrollments = len(self.enrolled_user_ids)
+        if draw is None:
+            return self.get_enrollment(rand.randrange(num_enrollments))
+        return self.get_enrollment(draw % num_enrollments)
+
+    def get_video_id(self, draw=None, rand=random):
+        """
+        Return a video id from our list of known video ids.
+
+        If given, draw is a random integer used to pick the id, otherwise it's drawn from rand.
+        """
+        if draw is None:
+            return rand.choice(self.video_ids)
+        return self.video_ids[draw % len(self.video_ids)]
+
+    def _generate_random_block_type_ids(self, block_type, count, rng):
+        return [
+            f"http://localhost:18000/xblock/block-v1:{self.course_id}+type@{block_type}+block@{block_uuid[:8]}"
+            for block_uuid in uuid4_strings(count, rng.bytes)
+        ]
+
+    def get_problem_id(self, draw=None, rand=random):
         """
         Return a problem id from our list of known problem ids.
+
+        If given, draw is a random integer used to pick the id, otherwise it's drawn from rand.
         """
-        return choice(self.problem_ids)
+        if draw is None:
+            return rand.choice(self.problem_ids)
+        return self.problem_ids[draw % len(self.problem_ids)]
 
-    def get_random_sequential_id(self):
+    def get_random_sequential_id(self, draw=None, rand=random):
         """
         Return a sequential id from our list of known sequential ids.
+
+        If given, draw is a random integer used to pick the id, otherwise it's drawn from rand.
         """
-        return choice(self.sequential_ids)
+        if draw is None:
+            return rand.choice(self.sequential_ids)
+        return self.sequential_ids[draw % len(self.sequential_ids)]
 
-    def get_random_forum_post_id(self):
+    def get_random_forum_post_id(self, draw=None, rand=random):
         """
-        Return a sequential id from our list of known sequential ids.
+        Return a forum post id from our list of known forum post ids.
+
+        If given, draw is a random integer used to pick the id, otherwise it's drawn from rand.
         """
-        return choice(self.forum_post_ids)
+        if draw is None:
+            return rand.choice(self.forum_post_ids)
+        return self.forum_post_ids[draw % len(self.forum_post_ids)]
 
-    def _generate_random_forum_post_id(self):
-        thread_id = str(uuid.uuid4())[:8]
-        return f"http://localhost:18000/api/discussion/v1/threads/{thread_id}"
+    @staticmethod
+    def _generate_random_forum_post_ids(count, rng):
+        return [
+            f"http://localhost:18000/api/discussion/v1/threads/{thread_id[:8]}"
+            for thread_id in uuid4_strings(count, rng.bytes)
+        ]
 
-    def get_random_nav_location(self):
+    def get_random_nav_location(self, rand=random):
         """
-        Return a navigation location from our list of known ids.
+        Return a navigation location from our list of known ids, drawn from rand.
         """
-        return str(randrange(1, self.items_in_course))
+        return str(rand.randrange(1, self.items_in_course))
 
     def serialize_course_data_for_event_sink(self):
         """
@@ -245,7 +415,7 @@ class RandomCourse:
             "course_end": self.end_date,
             "enrollment_start": self.start_date,
             "enrollment_end": self.end_date,
-            "self_paced": choice([True, False]),
+            "self_paced": self.self_paced,
             # This is a catchall field, we don't currently use it
             "course_data_json": "{}",
             "created": self.start_date,
@@ -282,6 +452,13 @@ class RandomCourse:
         Return lists of dicts representing block and block tag data.
 
         The data formats mirror what is created by event-sink-clickhouse.
+        These are serialized when the course is built.
+        """
+        return self.block_data
+
+    def _serialize_block_data(self, tags, rng):
+        """
+        Serialize the blocks for serialize_block_data_for_event_sink, in a random course structure.
         """
         blocks = []
         object_tags = []
@@ -306,7 +483,7 @@ class RandomCourse:
             course_structure.insert(
                 # Start at 2 here to make sure it's after the course and first
                 # chapter block
-                random.randint(2, len(course_structure)),
+                int(rng.integers(2, len(course_structure) + 1)),
                 self._serialize_block("sequential", s, cnt)
             )
             cnt += 1
@@ -316,7 +493,7 @@ class RandomCourse:
             course_structure.insert(
                 # Start at 3 here to make sure it's after the course and first
                 # chapter block and first sequential block
-                random.randint(2, len(course_structure)),
+                int(rng.integers(2, len(course_structure) + 1)),
                 self._serialize_block("vertical", v, cnt)
             )
             cnt += 1
@@ -326,7 +503,7 @@ class RandomCourse:
         # that they'll all be mixed together, but this will do for now.
         for b in blocks:
             course_structure.insert(
-                random.randint(4, len(course_structure)),
+                int(rng.integers(4, len(course_structure) + 1)),
                 b
             )
 
@@ -355,10 +532,10 @@ class RandomCourse:
 
             block["xblock_data_json"] = json.dumps(block["xblock_data_json"])
 
-            num_tags = randrange(0, 3)
+            num_tags = rng.integers(0, 3)
 
             for _ in range(num_tags):
-                tag = random.choice(self.all_tags)
+                tag = tags[rng.integers(len(tags))]
                 object_tag = copy.deepcopy(tag)
                 object_tag["object_id"] = block["location"]
                 object_tags.append(object_tag)
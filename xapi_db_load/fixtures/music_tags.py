@@ -36,4 +36,4 @@ TABLA,Tabla,DRUMS,
 PIANO,Piano,CHORD,
 """)
 
-MUSIC_TAGS = csv.DictReader(MUSIC_TAGS_CSV)
+MUSIC_TAGS = list(csv.DictReader(MUSIC_TAGS_CSV))
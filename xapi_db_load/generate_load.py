@@ -3,16 +3,26 @@ Generates batches of random xAPI events.
 """
 import datetime
 import json
+import multiprocessing
 import os
 import pprint
+import queue
 import random
-import uuid
+import threading
+from collections import deque
 from datetime import UTC
-from random import choice, choices
+from functools import partial
+from random import choice
 
-from xapi_db_load.course_configs import Actor, RandomCourse
+import numpy as np
+
+from xapi_db_load.checkpoint import Checkpoint
+from xapi_db_load.course_configs import ActorStore, RandomCourse
 from xapi_db_load.fixtures.music_tags import MUSIC_TAGS
-from xapi_db_load.utils import LogTimer, setup_timing
+from xapi_db_load.ids import UUIDPool, uuid4_strings_and_bytes
+from xapi_db_load.timestamps import format_timestamp
+from xapi_db_load.utils import ConfigurationError, LogTimer, setup_timing
+from xapi_db_load.xapi.xapi_common import EventSample
 from xapi_db_load.xapi.xapi_forum import PostCreated
 from xapi_db_load.xapi.xapi_grade import CourseGradeCalculated, FirstTimePassed
 from xapi_db_load.xapi.xapi_hint_answer import ShowAnswer, ShowHint
@@ -59,11 +69,35 @@ EVENT_LOAD = (
 
 EVENTS = [i[0] for i in EVENT_LOAD]
 EVENT_WEIGHTS = [i[1] for i in EVENT_LOAD]
+
+# numpy wants the weights as probabilities that sum to 1
+EVENT_PROBABILITIES = np.array(EVENT_WEIGHTS) / sum(EVENT_WEIGHTS)
+
+# Upper bound for the random integers drawn to pick actors and blocks, these are
+# taken modulo the number of actors / blocks in the course.
+MAX_DRAW = 2 ** 31
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Ids of the independent random streams derived from a seed
+SETUP_STREAM = 0
+UUID_STREAM = 1
+ENROLLMENT_STREAM = 2
+BATCH_STREAM = 3
+ACTOR_STREAM = 4
 
-def _get_uuid():
-    return str(uuid.uuid4())
+# Upper bound for the seeds given to the random module from a stream
+MAX_SEED = 2 ** 63
+
+
+def get_stream_rng(seed, *stream):
+    """
+    Return a numpy random generator for one stream of randomness derived from the seed.
+
+    stream is any number of non-negative integers identifying it, ex. BATCH_STREAM
+    and a batch index. Streams are statistically independent of each other
+    and don't depend on the platform or on any other random state.
+    """
+    return np.random.default_rng([seed, *stream])
 
 
 class EventGenerator:
@@ -71,13 +105,31 @@ class EventGenerator:
     Generates a batch of random xAPI events based on the EVENT_WEIGHTS proportions.
     """
 
-    actors = []
-    courses = []
-    orgs = []
-    taxonomies = {}
-    tags = []
-
     def __init__(self, config):
+        # These are all per-instance so that copies of the generator (ex. in
+        # worker processes) carry their own course, actor, and tag state.
+        self.actors = None
+        self.courses = []
+        self.orgs = []
+        self.taxonomies = {}
+        self.tags = []
+
+        # With a seed, everything the generator builds is the same every
+        # time, and each batch has its own random stream (see
+        # get_batch_events), so the same dataset can be generated again.
+        # All of the random state is kept here rather than in the random
+        # module or the shared UUID pool, so nothing else can change it.
+        self.seed = config.get("seed")
+        if self.seed is None:
+            self.random = random.Random()
+            self.uuid_pool = UUIDPool()
+        else:
+            self.random = random.Random(int(get_stream_rng(self.seed, SETUP_STREAM).integers(MAX_SEED)))
+            self.uuid_pool = UUIDPool(random_bytes=get_stream_rng(self.seed, UUID_STREAM).bytes)
+
+        # Random generator for sampling whole batches at once when unseeded
+        self.np_rng = np.random.default_rng()
+
         self.config = config
         self.start_date = config["start_date"]
         self.end_date = config["end_date"]
@@ -87,6 +139,9 @@ class EventGenerator:
         self.setup_actors()
         self.setup_courses()
 
+        # One instance of each event type, in the same order as EVENTS
+        self.event_types = [e(self) for e in EVENTS]
+
     def _validate_config(self):
         """
         Make sure the given values make sense.
@@ -111,35 +166,44 @@ class EventGenerator:
     def setup_courses(self):
         """
         Pre-create a number of courses based on the config.
+
+        The org, id and actors of each course are picked here, then the
+        courses are built (mostly generating and serializing their blocks) in
+        a pool of num_workers processes. Each course gets its own random seed,
+        so the courses are the same however many processes build them.
         """
+        course_args = []
+
+        # Bulk draws for the courses come from numpy, seeded from our random
+        # state so they follow the generator's seed.
+        rng = np.random.default_rng(self.random.getrandbits(64))
+
         for course_config_name, num_courses in self.config["num_course_sizes"].items():
             print(f"Setting up {num_courses} {course_config_name} courses")
 
             curr_num = 0
             while curr_num < num_courses:
                 course_config_makeup = self.config["course_size_makeup"][course_config_name]
-                org = choice(self.orgs)
-                actors = choices(self.actors, k=course_config_makeup["actors"])
-                runs = random.randrange(1, 5)
-                course_id = str(uuid.uuid4())[:6]
+                org = self.random.choice(self.orgs)
+                enrolled_user_ids = rng.integers(len(self.actors), size=course_config_makeup["actors"], dtype=np.int32)
+                runs = self.random.randrange(1, 5)
+                course_id = self.uuid_pool()[:6]
 
                 # Create 1-5 of the same course size / makeup / name
                 # but different course runs.
                 for run_id in range(runs):
-                    course = RandomCourse(
+                    course_args.append((
                         org,
                         course_id,
                         run_id,
                         self.start_date,
                         self.end_date,
                         self.config["course_length_days"],
-                        actors,
+                        enrolled_user_ids,
                         course_config_name,
                         course_config_makeup,
-                        self.tags
-                    )
-
-                    self.courses.append(course)
+                        int(rng.integers(MAX_SEED)),
+                    ))
 
                     curr_num += 1
 
@@ -148,13 +212,26 @@ class EventGenerator:
                     if curr_num == num_courses:
                         break
 
+        build_course = partial(_build_course, self.tags)
+        num_workers = self.config.get("num_workers", 1)
+        if num_workers > 1:
+            with multiprocessing.Pool(num_workers) as pool:
+                self.courses = pool.map(build_course, course_args)
+        else:
+            self.courses = [build_course(args) for args in course_args]
+
+        # The ActorStore is attached here rather than copied to and from the workers
+        for course in self.courses:
+            course.actors = self.actors
+
     def setup_actors(self):
         """
         Create all known actors.
 
         Random samplings of these will be passed into courses.
         """
-        self.actors = [Actor(i) for i in range(self.config["num_actors"])]
+        rng = np.random.default_rng() if self.seed is None else get_stream_rng(self.seed, ACTOR_STREAM)
+        self.actors = ActorStore(self.config["num_actors"], rng)
 
     @staticmethod
     def _get_hierarchy(tag_hierarchy, start_parent_id):
@@ -181,7 +258,8 @@ class EventGenerator:
         """
         Load a sample set of tags and format them for use.
         """
-        self.taxonomies["Music"] = list(MUSIC_TAGS)
+        # Copy the tags so that each generator can annotate its own
+        self.taxonomies["Music"] = [dict(tag) for tag in MUSIC_TAGS]
 
         # tag_hierarchy holds all of the known tags and their parents. This
         # works because the incoming CSV is sorted in a parent-first way. So
@@ -205,23 +283,73 @@ class EventGenerator:
                 tag_hierarchy[tag["id"]] = (tag["value"], tag["parent_id"], tag["tag_id"])
                 self.tags.append(tag)
 
-    def get_batch_events(self):
+    def get_batch_events(self, batch_index=None):
         """
         Create a batch size list of random events.
 
         Events are from our EVENTS list, based on the EVENT_WEIGHTS proportions.
+        The random values for the whole batch (event ids, event types, courses,
+        actors, blocks and emission times) are drawn in one pass as numpy
+        arrays, so building each event is mostly formatting.
+
+        If the generator is seeded, all of the randomness in the batch comes
+        from a stream for batch_index alone, so a batch is the same no matter
+        which process or machine generates it, or in what order.
         """
-        events = choices(EVENTS, EVENT_WEIGHTS, k=self.config["batch_size"])
-        return [e(self).get_data() for e in events]
+        batch_size = self.config["batch_size"]
+        rng = self.np_rng
+        rand = self.random
+        random_bytes = os.urandom
+        if self.seed is not None:
+            rng = get_stream_rng(self.seed, BATCH_STREAM, batch_index)
+            random_bytes = rng.bytes
+
+            # The event types draw the rest of their values from this
+            rand = random.Random(int(rng.integers(MAX_SEED)))
+
+        # tolist() gets us plain Python values, which are much faster to work
+        # with one at a time than numpy scalars.
+        event_indexes = rng.choice(len(EVENTS), size=batch_size, p=EVENT_PROBABILITIES).tolist()
+        course_indexes = rng.integers(len(self.courses), size=batch_size).tolist()
+        actor_draws = rng.integers(MAX_DRAW, size=batch_size).tolist()
+        block_draws = rng.integers(MAX_DRAW, size=batch_size).tolist()
+        time_draws = rng.random(batch_size).tolist()
+        event_ids, event_uuids = uuid4_strings_and_bytes(batch_size, random_bytes)
+
+        events = []
+        for event_id, event_uuid, event_index, course_index, actor_draw, block_draw, time_draw in zip(
+            event_ids, event_uuids, event_indexes, course_indexes, actor_draws, block_draws, time_draws
+        ):
+            course = self.courses[course_index]
+            enrolled_actor = course.get_enrolled_actor(actor_draw)
+            emission_epoch = course.get_random_emission_time(enrolled_actor, time_draw)
+            sample = EventSample(event_id, course, enrolled_actor, format_timestamp(emission_epoch), block_draw, rand)
+            events.append(_add_typed_values(self.event_types[event_index].get_data(sample), event_uuid, emission_epoch))
+
+        return events
 
     def get_enrollment_events(self):
         """
         Generate enrollment events for all actors.
         """
+        registered = Registered(self)
+        rand = self.random
+        random_bytes = os.urandom
+        if self.seed is not None:
+            rng = get_stream_rng(self.seed, ENROLLMENT_STREAM)
+            random_bytes = rng.bytes
+            rand = random.Random(int(rng.integers(MAX_SEED)))
+
+        num_enrollments = sum(len(course.enrolled_user_ids) for course in self.courses)
+        event_ids, event_uuids = uuid4_strings_and_bytes(num_enrollments, random_bytes)
+        event_ids = iter(event_ids)
+        event_uuids = iter(event_uuids)
         enrollments = []
         for course in self.courses:
-            for actor in course.actors:
-                enrollments.append(Registered(self).get_data(course, actor))
+            for actor in course.get_enrollments():
+                emission_epoch = course.get_random_emission_time(actor, rand=rand)
+                sample = EventSample(next(event_ids), course, actor, format_timestamp(emission_epoch), 0, rand)
+                enrollments.append(_add_typed_values(registered.get_data(sample), next(event_uuids), emission_epoch))
         return enrollments
 
     def get_course(self):
@@ -244,12 +372,39 @@ class EventGenerator:
             pprint.pprint(c)
 
 
-def generate_events(config, backend):
+def generate_events(config, backend, resume=False):
     """
     Generate the actual events in the backend, using the given config.
+
+    If resume is True, carry on from the checkpoint of an interrupted run.
+    """
+    try:
+        _generate_events(config, backend, resume)
+    except BaseException:
+        # Don't leave background writers waiting forever for more batches
+        backend.abort()
+        raise
+
+
+def _generate_events(config, backend, resume):
+    """
+    Do the work of generate_events.
     """
     setup_timing(config["log_dir"])
 
+    # File backends can't pick up where they left off, so are not checkpointed
+    checkpoint = None
+    if resume:
+        if not backend.can_resume:
+            raise ConfigurationError(f"The {config['backend']} backend can't resume an interrupted run.")
+        checkpoint = Checkpoint.resume(config)
+        print(f"Resuming after batch {checkpoint.batches_completed} with seed {checkpoint.seed}")
+    elif backend.can_resume:
+        checkpoint = Checkpoint.start(config)
+
+    if checkpoint is not None:
+        config["seed"] = checkpoint.seed
+
     print("Checking table existence and current row count in backend...")
     backend.print_row_counts()
     start = datetime.datetime.now(UTC)
@@ -258,28 +413,65 @@ def generate_events(config, backend):
         with LogTimer("setup", "event_generator"):
             event_generator = EventGenerator(config)
 
-    print("Inserting course metadata...")
-    with LogTimer("insert_metadata", "course"):
-        backend.insert_event_sink_course_data(event_generator.courses, config["num_course_publishes"])
-
-    print("Inserting block metadata...")
-    with LogTimer("insert_metadata", "blocks"):
-        backend.insert_event_sink_block_data(event_generator.courses, config["num_course_publishes"])
-
-    print("Inserting user data...")
-    with LogTimer("insert_metadata", "user_data"):
-        backend.insert_event_sink_actor_data(event_generator.actors, config["num_actor_profile_changes"])
-
-    print("Inserting taxonomy data...")
-    with LogTimer("insert_metadata", "taxonomy"):
-        backend.insert_event_sink_taxonomies(event_generator.taxonomies)
-
-    print("Inserting tag data...")
-    with LogTimer("insert_metadata", "tag"):
-        backend.insert_event_sink_tag_data(event_generator.tags)
-
-    insert_registrations(event_generator, backend)
-    insert_batches(event_generator, config["num_batches"], backend)
+    metadata_phases = (
+        (
+            "course",
+            "course metadata",
+            lambda: backend.insert_event_sink_course_data(event_generator.courses, config["num_course_publishes"]),
+        ),
+        (
+            "blocks",
+            "block metadata",
+            lambda: backend.insert_event_sink_block_data(event_generator.courses, config["num_course_publishes"]),
+        ),
+        (
+            "user_data",
+            "user data",
+            lambda: backend.insert_event_sink_actor_data(event_generator.actors, config["num_actor_profile_changes"]),
+        ),
+        (
+            "taxonomy",
+            "taxonomy data",
+            lambda: backend.insert_event_sink_taxonomies(event_generator.taxonomies),
+        ),
+        (
+            "tag",
+            "tag data",
+            lambda: backend.insert_event_sink_tag_data(event_generator.tags),
+        ),
+    )
+
+    for phase, description, insert in metadata_phases:
+        if checkpoint is not None and checkpoint.phase_done(phase):
+            print(f"Skipping {description}, it was inserted before the checkpoint.")
+            continue
+
+        print(f"Inserting {description}...")
+        with LogTimer("insert_metadata", phase):
+            insert()
+
+        if checkpoint is not None:
+            checkpoint.complete_phase(phase)
+
+    if checkpoint is not None and checkpoint.phase_done("enrollment"):
+        print("Skipping enrollment events, they were inserted before the checkpoint.")
+    else:
+        insert_registrations(event_generator, backend)
+        if checkpoint is not None:
+            backend.flush()
+            checkpoint.complete_phase("enrollment")
+
+    insert_batches(
+        event_generator,
+        config["num_batches"],
+        backend,
+        config.get("num_workers", 1),
+        config.get("pipeline_queue_depth", 0),
+        checkpoint,
+    )
+
+    # Backends may still be sending batches in the background
+    backend.finalize()
 
     with LogTimer("batches", "total"):
         print(f"Done! Added {config['num_batches'] * config['batch_size']:,} rows!")
@@ -287,7 +479,6 @@ def generate_events(config, backend):
     end = datetime.datetime.now(UTC)
     print("Batch insert time: " + str(end - start))
 
-    backend.finalize()
     backend.print_db_time()
     backend.print_row_counts()
 
@@ -308,23 +499,184 @@ def insert_registrations(event_generator, lake):
     print(f"{len(events)} enrollment events inserted.")
 
 
-def insert_batches(event_generator, num_batches, lake):
+def insert_batches(event_generator, num_batches, lake, num_workers=1, queue_depth=0, checkpoint=None):
     """
     Generate and insert num_batches of events.
+
+    If num_workers is greater than 1 the batches are generated in a pool of
+    worker processes and inserted from this process as they are returned.
+
+    If queue_depth is greater than 0 generation and insertion are pipelined:
+    generated batches wait in a queue of at most queue_depth batches while a
+    separate thread inserts them.
+
+    If a checkpoint is given, batches it has already recorded are skipped and
+    progress is saved to it as batches are committed.
     """
-    for x in range(num_batches):
-        if x % 100 == 0:
-            print(f"{x} of {num_batches}")
-            lake.print_db_time()
+    start_batch = checkpoint.batches_completed if checkpoint is not None else 0
+
+    if num_workers > 1:
+        print(f"Generating batches with {num_workers} worker processes")
+        batches = _generate_batches_in_pool(event_generator, range(start_batch, num_batches), num_workers)
+    else:
+        batches = (event_generator.get_batch_events(x) for x in range(start_batch, num_batches))
 
+    if queue_depth > 0:
+        print(f"Pipelining batch inserts with a queue depth of {queue_depth}")
+        _insert_batches_pipelined(event_generator, batches, start_batch, num_batches, lake, queue_depth, checkpoint)
+        return
+
+    for x in range(start_batch, num_batches):
         with LogTimer("batch", "get_events"):
-            events = event_generator.get_batch_events()
+            events = next(batches)
+
+        _insert_batch(event_generator, x, num_batches, events, lake, checkpoint)
+
+
+def _insert_batch(event_generator, x, num_batches, events, lake, checkpoint=None):
+    """
+    Insert one generated batch, occasionally running queries and printing progress.
+    """
+    if x % 100 == 0:
+        print(f"{x} of {num_batches}")
+        lake.print_db_time()
+
+    with LogTimer("batch", "insert_events"):
+        lake.batch_insert(events)
+
+    if checkpoint is not None and checkpoint.is_due(x + 1):
+        # Backends may still be sending batches in the background, a batch
+        # only counts once it's definitely in the backend.
+        with LogTimer("batch", "checkpoint"):
+            lake.flush()
+            checkpoint.complete_batches(x + 1)
+
+    if x % 1000 == 0:
+        with LogTimer("batch", "all_queries"):
+            lake.do_queries(event_generator)
+        lake.print_db_time()
+        lake.print_row_counts()
+
+
+def _insert_batches_pipelined(event_generator, batches, start_batch, num_batches, lake, queue_depth, checkpoint=None):
+    """
+    Generate batches in this thread while a sender thread inserts them.
+
+    The sender thread is the only one that talks to the backend, so the
+    backends don't need to be thread safe.
+    """
+    batch_queue = queue.Queue(maxsize=queue_depth)
+    errors = []
+
+    def send():
+        # Any failure, even a BaseException, ends the thread with the error
+        # recorded. The generating side sees it or that the thread is gone.
+        try:
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    return
+
+                x, events = item
+                _insert_batch(event_generator, x, num_batches, events, lake, checkpoint)
+        except BaseException as e:
+            errors.append(e)
+
+    def put(item):
+        """
+        Queue an item for the sender, returning False if the sender stopped before taking it.
+        """
+        while sender.is_alive():
+            try:
+                batch_queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    sender = threading.Thread(target=send, name="batch_sender")
+    sender.start()
+
+    try:
+        for x in range(start_batch, num_batches):
+            if errors:
+                break
+
+            with LogTimer("batch", "get_events"):
+                events = next(batches)
+
+            with LogTimer("batch", "queue_wait"):
+                if not put((x, events)):
+                    break
+    finally:
+        put(None)
+        sender.join()
+
+    if errors:
+        raise errors[0]
+
+
+def _add_typed_values(event, event_uuid, emission_epoch):
+    """
+    Add the event id as 16 UUID bytes and the emission time as epoch seconds to an event dict.
+
+    Backends that insert typed columns (ClickHouse) use these instead of
+    parsing the event_id and emission_time strings again.
+    """
+    event["event_uuid"] = event_uuid
+    event["emission_epoch"] = emission_epoch
+    return event
+
+
+def _build_course(tags, course_args):
+    """
+    Build one RandomCourse from the arguments picked in EventGenerator.setup_courses.
+    """
+    *args, seed = course_args
+    return RandomCourse(*args, tags, np.random.default_rng(seed))
+
+
+# Each worker process gets its own copy of the EventGenerator, this is where it
+# is stored.
+_worker_event_generator = None
+
+
+def _init_worker(event_generator):
+    """
+    Store a copy of the event generator in a newly started worker process.
+    """
+    global _worker_event_generator  # pylint: disable=global-statement
+    _worker_event_generator = event_generator
+
+    # Forked workers inherit the parent's random state, without re-seeding
+    # every worker would generate the same batches. Seeded generators get the
+    # random state for each batch from its index instead.
+    _worker_event_generator.random = random.Random()
+    _worker_event_generator.np_rng = np.random.default_rng()
+
+
+def _get_worker_batch_events(batch_index):
+    """
+    Generate one batch of events in a worker process.
+    """
+    return _worker_event_generator.get_batch_events(batch_index)
+
+
+def _generate_batches_in_pool(event_generator, batch_indexes, num_workers):
+    """
+    Yield the batches of events for batch_indexes, generated in a pool of worker processes.
+
+    Only a couple of batches per worker are allowed to be in flight at once so
+    that generation can't run away from a slow backend and use up all memory.
+    """
+    max_pending = num_workers * 2
 
-        with LogTimer("batch", "insert_events"):
-            lake.batch_insert(events)
+    with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(event_generator,)) as pool:
+        pending = deque()
+        for batch_index in batch_indexes:
+            pending.append(pool.apply_async(_get_worker_batch_events, (batch_index,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
 
-        if x % 1000 == 0:
-            with LogTimer("batch", "all_queries"):
-                lake.do_queries(event_generator)
-            lake.print_db_time()
-            lake.print_row_counts()
+        while pending:
+            yield pending.popleft().get()
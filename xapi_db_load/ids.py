@@ -0,0 +1,123 @@
+"""
+Fast generation of random UUID strings.
+
+str(uuid.uuid4()) costs an os.urandom call plus a UUID object per id, which adds
+up over billions of statements. These make many UUIDs from one block of random
+bytes instead. The ids are only used for test data, so the random bytes can
+come from any source (ex. a seeded generator), they don't need to be
+cryptographically secure.
+"""
+import os
+
+import numpy as np
+
+# Lowercase hex digits as ASCII bytes, indexed by their value
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+# Positions of the hex digits in a 36 character UUID string, the rest are dashes
+HEX_POSITIONS = [i for i in range(36) if i not in (8, 13, 18, 23)]
+
+
+def _uuid4_bytes(count, random_bytes):
+    """
+    Return a (count, 16) numpy array of the bytes of count random version 4 UUIDs.
+    """
+    raw = np.frombuffer(random_bytes(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+
+    # Set the version 4 and RFC 4122 variant bits, just like uuid.uuid4()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    return raw
+
+
+def _format_uuid4_array(raw):
+    """
+    Return the UUIDs in the (count, 16) array raw as a numpy array of 36 byte ASCII strings.
+    """
+    count = len(raw)
+
+    # Build all of the strings as one array of ASCII characters
+    chars = np.full((count, 36), ord("-"), dtype=np.uint8)
+    digits = np.empty((count, 32), dtype=np.uint8)
+    digits[:, 0::2] = HEX_DIGITS[raw >> 4]
+    digits[:, 1::2] = HEX_DIGITS[raw & 0x0F]
+    chars[:, HEX_POSITIONS] = digits
+
+    return chars.view("S36").reshape(count)
+
+
+def _split_uuid4_strings(uuids):
+    """
+    Return a list of str from a numpy array of 36 byte UUID strings.
+    """
+    all_uuids = uuids.tobytes().decode("ascii")
+    return [all_uuids[i:i + 36] for i in range(0, len(all_uuids), 36)]
+
+
+def uuid4_array(count, random_bytes=os.urandom):
+    """
+    Return a numpy array of count random version 4 UUIDs as 36 byte ASCII strings.
+
+    This takes much less memory than a list of str for large numbers of ids.
+    random_bytes is a function that returns the given number of random bytes.
+    """
+    return _format_uuid4_array(_uuid4_bytes(count, random_bytes))
+
+
+def uuid4_strings(count, random_bytes=os.urandom):
+    """
+    Return a list of count random version 4 UUID strings.
+
+    These are formatted exactly like str(uuid.uuid4()). random_bytes is a
+    function that returns the given number of random bytes.
+    """
+    return _split_uuid4_strings(uuid4_array(count, random_bytes))
+
+
+def uuid4_strings_and_bytes(count, random_bytes=os.urandom):
+    """
+    Return lists of count random version 4 UUID strings, and the same UUIDs as 16 bytes each.
+
+    The bytes are what backends that store UUIDs natively (ex. ClickHouse)
+    need, so they don't have to parse the strings again.
+    """
+    raw = _uuid4_bytes(count, random_bytes)
+    all_bytes = raw.tobytes()
+    return (
+        _split_uuid4_strings(_format_uuid4_array(raw)),
+        [all_bytes[i:i + 16] for i in range(0, len(all_bytes), 16)],
+    )
+
+
+class UUIDPool:
+    """
+    Hands out random UUID strings one at a time, generating them in blocks.
+
+    Call the pool to get a new UUID string.
+    """
+
+    def __init__(self, block_size=10000, random_bytes=os.urandom):
+        self.block_size = block_size
+        self.random_bytes = random_bytes
+        self._uuids = []
+
+    def __call__(self):
+        """
+        Return the next UUID string, generating a new block if they've all been used.
+        """
+        if not self._uuids:
+            self._uuids = uuid4_strings(self.block_size, self.random_bytes)
+        return self._uuids.pop()
+
+    def reset(self):
+        """
+        Throw away any UUIDs that have already been generated.
+        """
+        self._uuids = []
+
+
+# Shared pool for everywhere that needs a single random UUID
+get_uuid = UUIDPool()
+
+# A forked process would otherwise hand out the same UUIDs as its parent
+os.register_at_fork(after_in_child=get_uuid.reset)
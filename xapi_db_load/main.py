@@ -5,7 +5,8 @@ import click
 import yaml
 
 from xapi_db_load.generate_load import generate_events
-from xapi_db_load.utils import get_backend_from_config
+from xapi_db_load.replay import replay_statements
+from xapi_db_load.utils import get_backend_from_config, get_file_format
 
 
 def get_config(config_file):
@@ -38,23 +39,40 @@ def cli():
         writable=False
     )
 )
-def load_db(config_file):
+@click.option(
+    "--resume",
+    help="Continue an interrupted run from its checkpoint file.",
+    is_flag=True,
+    default=False,
+)
+def load_db(config_file, resume):
     """
     Execute a database load by performing inserts.
     """
     config = get_config(config_file)
-    backend = get_backend_from_config(config)
-    generate_events(config, backend)
 
     try_s3_load = config.get("csv_load_from_s3_after")
+    try_local_load = config.get("csv_load_from_local_after")
+
+    # Make sure the files can be loaded before spending time generating them
+    file_format = get_file_format(config) if try_s3_load or try_local_load else None
+
+    backend = get_backend_from_config(config)
+    generate_events(config, backend, resume)
 
-    if try_s3_load:
-        print("Attempting to load to ClickHouse from S3...")
+    if try_s3_load or try_local_load:
         # No matter what the configured backend is for event generation we need to
         # use the clickhouse config for the load.
+        config["file_format"] = file_format
         config["backend"] = "clickhouse"
         ch_backend = get_backend_from_config(config)
-        ch_backend.load_from_s3(config["s3_source_location"])
+
+        if try_s3_load:
+            print("Attempting to load to ClickHouse from S3...")
+            ch_backend.load_from_s3(config["s3_source_location"])
+        else:
+            print("Attempting to load to ClickHouse from local files...")
+            ch_backend.load_from_local(config["csv_output_destination"])
 
     print("Done.")
 
@@ -79,13 +97,67 @@ def load_db_from_s3(config_file):
     config = get_config(config_file)
 
     # When loading from S3 we always need the clickhouse backend.
+    config["file_format"] = get_file_format(config)
     config["backend"] = "clickhouse"
     backend = get_backend_from_config(config)
     backend.load_from_s3(config["s3_source_location"])
 
 
+@click.command()
+@click.option(
+    "--config_file",
+    help="Configuration file.",
+    required=True,
+    default="default_config.yaml",
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        writable=False
+    )
+)
+def load_db_from_local(config_file):
+    """
+    Execute the database load by streaming existing local files to ClickHouse.
+    """
+    config = get_config(config_file)
+
+    # Files are always loaded with the clickhouse backend.
+    config["file_format"] = get_file_format(config)
+    config["backend"] = "clickhouse"
+    backend = get_backend_from_config(config)
+    backend.load_from_local(config["csv_output_destination"])
+
+
+@click.command()
+@click.option(
+    "--config_file",
+    help="Configuration file.",
+    required=True,
+    default="default_config.yaml",
+    type=click.Path(
+        exists=True,
+        dir_okay=False,
+        file_okay=True,
+        writable=False
+    )
+)
+def load_lrs_from_jsonl(config_file):
+    """
+    Send statements written by the jsonl_file backend to Ralph.
+    """
+    config = get_config(config_file)
+
+    # The files are always replayed into the LRS.
+    config["backend"] = "ralph_clickhouse"
+    backend = get_backend_from_config(config)
+    replay_statements(config, backend)
+
+
 cli.add_command(load_db)
 cli.add_command(load_db_from_s3)
+cli.add_command(load_db_from_local)
+cli.add_command(load_lrs_from_jsonl)
 
 if __name__ == "__main__":
     cli()
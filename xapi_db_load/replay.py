@@ -0,0 +1,70 @@
+"""
+Replay xAPI statements written by the jsonl_file backend into an LRS.
+
+Each line of the files is already a serialized statement, so lines are sent
+to the backend as bytes without being parsed.
+"""
+import glob
+import os
+from datetime import datetime
+
+from xapi_db_load.compression import open_compressed_input
+from xapi_db_load.utils import LogTimer, setup_timing
+
+
+def get_jsonl_files(config):
+    """
+    Return the sorted list of statement files to replay.
+
+    "jsonl_source" is a glob of local files, by default all of the xAPI files
+    in csv_output_destination.
+    """
+    source = config.get("jsonl_source") or os.path.join(config["csv_output_destination"], "xapi_*.jsonl*")
+    return sorted(glob.glob(source))
+
+
+def read_statement_batches(file_names, batch_size):
+    """
+    Yield lists of up to batch_size statements, as bytes, from the given files.
+    """
+    batch = []
+    for file_name in file_names:
+        with open_compressed_input(file_name) as f:
+            for line in f:
+                line = line.rstrip(b"\n")
+                if not line:
+                    continue
+                batch.append(line)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def replay_statements(config, backend):
+    """
+    Send every statement in the configured JSON Lines files to the backend.
+    """
+    setup_timing(config["log_dir"])
+
+    file_names = get_jsonl_files(config)
+    if not file_names:
+        raise FileNotFoundError("No JSON Lines statement files found to replay.")
+
+    print(f"Replaying statements from {len(file_names)} files...")
+    start = datetime.now()
+    statement_count = 0
+
+    with LogTimer("replay", "total"):
+        for x, statements in enumerate(read_statement_batches(file_names, config["batch_size"]), start=1):
+            with LogTimer("replay", "send_statements"):
+                backend.send_statements(statements)
+            statement_count += len(statements)
+
+            if x % 100 == 0:
+                print(f"{statement_count:,} statements sent")
+
+        backend.finalize()
+
+    print(f"Done! Sent {statement_count:,} statements in {datetime.now() - start}")
@@ -1,15 +1,37 @@
 """
 Tests for xapi-db-load.py.
 """
+import datetime
+import glob
 import gzip
+import io
+import json
 import os
+import random
+import re
+import struct
+import uuid
 from contextlib import contextmanager
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
+import numpy as np
+import pytest
 import yaml
+import zstandard
 from click.testing import CliRunner
+from clickhouse_connect.driver import exceptions as clickhouse_exceptions
+from clickhouse_connect.driver.summary import QuerySummary
 
-from xapi_db_load.main import load_db
+from xapi_db_load.backends.progress import QueryProgressMonitor
+from xapi_db_load.backends.schemas import FILE_SCHEMAS
+from xapi_db_load.compression import BlockCompressingWriter
+from xapi_db_load.course_configs import ActorStore, RandomCourse
+from xapi_db_load.generate_load import EventGenerator, generate_events, insert_batches
+from xapi_db_load.ids import UUIDPool, get_uuid, uuid4_strings
+from xapi_db_load.main import load_db, load_db_from_s3, load_lrs_from_jsonl
+from xapi_db_load.timestamps import date_to_epoch, format_timestamp
+from xapi_db_load.utils import ConfigurationError, get_backend_from_config
+from xapi_db_load.xapi.xapi_common import Slot, StatementTemplate, encode_bool, encode_string
 
 
 @contextmanager
@@ -19,9 +41,7 @@ def override_config(config_path, tmpdir):
 
     Overrides for both the test code and the loading code.
     """
-    with open(config_path, "r") as f:
-        test_config = yaml.safe_load(f)
-
+    test_config = load_test_config(config_path)
     test_config["log_dir"] = str(tmpdir)
     test_config["csv_output_destination"] = str(tmpdir)
 
@@ -33,10 +53,37 @@ def override_config(config_path, tmpdir):
             pass
 
 
-def test_csv(tmpdir):
+def load_test_config(config_path="xapi_db_load/tests/fixtures/small_config.yaml"):
+    """
+    Return the parsed test config, the small config by default.
+    """
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def get_expected_statements(config):
+    """
+    Return the number of xAPI statements a run with the config generates.
+
+    That is every event in every batch plus an enrollment event for each
+    actor enrolled in each course.
+    """
+    expected_enrollments = sum(
+        num_courses * config["course_size_makeup"][size]["actors"]
+        for size, num_courses in config["num_course_sizes"].items()
+    )
+    return config["num_batches"] * config["batch_size"] + expected_enrollments
+
+
+@pytest.mark.parametrize("num_workers,queue_depth,csv_writers", [(1, 0, 1), (2, 0, 1), (1, 2, 1), (2, 2, 2)])
+def test_csv(num_workers, queue_depth, csv_writers, tmpdir):
     test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
 
     with override_config(test_path, tmpdir) as test_config:
+        test_config["num_workers"] = num_workers
+        test_config["pipeline_queue_depth"] = queue_depth
+        test_config["csv_writers"] = csv_writers
+        test_config["csv_shard_rows"] = 120
         runner = CliRunner()
         result = runner.invoke(
             load_db,
@@ -50,8 +97,7 @@ def test_csv(tmpdir):
 
         makeup = test_config["course_size_makeup"]["small"]
 
-        expected_enrollments = test_config["num_course_sizes"]["small"] * makeup["actors"]
-        expected_statements = test_config["num_batches"] * test_config["batch_size"] + expected_enrollments
+        expected_statements = get_expected_statements(test_config)
         expected_profiles = test_config["num_actors"] * test_config["num_actor_profile_changes"]
         expected_external_ids = test_config["num_actors"]
         expected_courses = test_config["num_course_sizes"]["small"] * test_config["num_course_publishes"]
@@ -63,8 +109,16 @@ def test_csv(tmpdir):
         # Plus 1 for the course block
         expected_blocks = (expected_course_blocks + 1) * expected_courses
 
+        # xAPI statements are split into shards of at most csv_shard_rows rows
+        xapi_rows = 0
+        for shard in glob.glob(os.path.join(test_config["log_dir"], "xapi_*.csv.gz")):
+            with gzip.open(shard, "r") as csv:
+                shard_rows = len(csv.readlines())
+                assert shard_rows <= test_config["csv_shard_rows"]
+                xapi_rows += shard_rows
+        assert xapi_rows == expected_statements, "Bad row count in xapi csv shards."
+
         for prefix, expected in (
-            ("xapi", expected_statements),
             ("courses", expected_courses),
             ("blocks", expected_blocks),
             ("external_ids", expected_external_ids),
@@ -74,11 +128,375 @@ def test_csv(tmpdir):
                 assert len(csv.readlines()) == expected, f"Bad row count in csv file {prefix}.csv.gz."
 
 
+def _read_varint(data, pos):
+    """
+    Read a ClickHouse LEB128 varint, returning it and the position after it.
+    """
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def _count_xapi_rows(data, file_format):
+    """
+    Decode the rows of an xAPI file, checking that each statement is valid JSON.
+    """
+    if file_format == "TabSeparated":
+        lines = data.decode("utf-8").splitlines()
+        for line in lines:
+            event_id, _, event = line.split("\t")
+            assert json.loads(event.replace("\\\\", "\\"))["id"] == event_id
+        return len(lines)
+
+    rows = 0
+    pos = 0
+    if file_format == "Native":
+        # Native blocks start with their column and row counts, then the columns
+        while pos < len(data):
+            num_columns, pos = _read_varint(data, pos)
+            num_rows, pos = _read_varint(data, pos)
+            assert num_columns == 3
+            rows += num_rows
+            for _ in range(num_columns):
+                for _ in range(2):
+                    length, pos = _read_varint(data, pos)
+                    name_or_type = data[pos:pos + length].decode()
+                    pos += length
+                if name_or_type == "UUID":
+                    pos += 16 * num_rows
+                elif name_or_type.startswith("DateTime64"):
+                    pos += 8 * num_rows
+                else:
+                    for _ in range(num_rows):
+                        length, pos = _read_varint(data, pos)
+                        assert json.loads(data[pos:pos + length])["id"]
+                        pos += length
+        return rows
+
+    # RowBinary rows are a 16 byte UUID, 8 byte DateTime64, and the statement string
+    while pos < len(data):
+        high, low, micros = struct.unpack_from("<QQq", data, pos)
+        pos += 24
+        length, pos = _read_varint(data, pos)
+        statement = json.loads(data[pos:pos + length])
+        assert str(uuid.UUID(int=(high << 64) | low)) == statement["id"]
+        assert format_timestamp(micros // 1000000) == statement["timestamp"]
+        pos += length
+        rows += 1
+    return rows
+
+
+@pytest.mark.parametrize("file_format,extension", [
+    ("TabSeparated", "tsv"),
+    ("RowBinary", "rowbinary"),
+    ("Native", "native"),
+])
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_file_formats(mock_clickhouse, file_format, extension, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["file_format"] = file_format
+        test_config["csv_shard_rows"] = 120
+        test_config["csv_load_from_s3_after"] = True
+        test_config["s3_source_location"] = "https://bucket.s3.amazonaws.com/logs/"
+        runner = CliRunner()
+        result = runner.invoke(
+            load_db,
+            f"--config_file {test_path}",
+            catch_exceptions=False
+        )
+
+    assert "Done." in result.output
+
+    expected_statements = get_expected_statements(test_config)
+
+    xapi_rows = 0
+    for shard in glob.glob(os.path.join(test_config["log_dir"], f"xapi_*.{extension}.gz")):
+        with gzip.open(shard, "rb") as f:
+            xapi_rows += _count_xapi_rows(f.read(), file_format)
+    assert xapi_rows == expected_statements
+
+    for prefix in ("courses", "blocks", "external_ids", "user_profiles", "taxonomies", "tags", "object_tags"):
+        assert os.path.exists(os.path.join(test_config["log_dir"], f"{prefix}.{extension}.gz"))
+
+    # The load from S3 reads the same format, with the structure if the format needs it
+    loads = [c.args[0] for c in mock_clickhouse.get_client.return_value.command.call_args_list]
+    assert len(loads) == 8
+    assert all(f"'{file_format}'" in sql for sql in loads)
+    xapi_load = next(sql for sql in loads if "xapi_events_all" in sql)
+    assert f"xapi*.{extension}.gz" in xapi_load
+    assert ("`event_id` UUID" in xapi_load) == (file_format != "Native")
+
+
+@pytest.mark.parametrize("csv_writers", [1, 2])
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_parquet(mock_clickhouse, csv_writers, tmpdir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["backend"] = "parquet_file"
+        test_config["csv_writers"] = csv_writers
+        test_config["csv_shard_rows"] = 120
+        test_config["parquet_row_group_size"] = 50
+        test_config["csv_load_from_s3_after"] = True
+        test_config["s3_source_location"] = "https://bucket.s3.amazonaws.com/logs/"
+        runner = CliRunner()
+        result = runner.invoke(
+            load_db,
+            f"--config_file {test_path}",
+            catch_exceptions=False
+        )
+
+    assert "Done." in result.output
+
+    expected_statements = get_expected_statements(test_config)
+
+    xapi_rows = 0
+    for shard in glob.glob(os.path.join(test_config["log_dir"], "xapi_*.parquet")):
+        table = pq.read_table(shard)
+        assert table.num_rows <= test_config["csv_shard_rows"]
+        assert table.column_names == ["event_id", "emission_time", "event"]
+        assert str(table.schema.field("emission_time").type) == "timestamp[us, tz=UTC]"
+        xapi_rows += table.num_rows
+    assert xapi_rows == expected_statements
+
+    for prefix in ("courses", "blocks", "external_ids", "user_profiles", "taxonomies", "tags", "object_tags"):
+        assert pq.read_table(os.path.join(test_config["log_dir"], f"{prefix}.parquet")).num_rows > 0
+
+    # The load from S3 reads the Parquet files
+    loads = [c.args[0] for c in mock_clickhouse.get_client.return_value.command.call_args_list]
+    assert len(loads) == 8
+    assert all("'Parquet'" in sql for sql in loads)
+    assert any("xapi*.parquet" in sql for sql in loads)
+
+
+@pytest.mark.parametrize("compression,extension", [("gzip", "gz"), ("zstd", "zst")])
+@patch("xapi_db_load.backends.ralph_lrs.requests")
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_jsonl_replay(_, mock_requests, compression, extension, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+    runner = CliRunner()
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["backend"] = "jsonl_file"
+        test_config["csv_compression"] = compression
+        test_config["csv_writers"] = 2
+        test_config["csv_shard_rows"] = 120
+        result = runner.invoke(
+            load_db,
+            f"--config_file {test_path}",
+            catch_exceptions=False
+        )
+
+    assert "Done." in result.output
+
+    expected_statements = get_expected_statements(test_config)
+
+    # Statements are written one per line as plain JSON, other files as CSV
+    shards = glob.glob(os.path.join(test_config["log_dir"], f"xapi_*.jsonl.{extension}"))
+    assert len(shards) > 1
+    assert os.path.exists(os.path.join(test_config["log_dir"], f"courses.csv.{extension}"))
+
+    # The replay reads the files back and POSTs them without parsing them
+    ralph_path = "xapi_db_load/tests/fixtures/small_ralph_config.yaml"
+    with override_config(ralph_path, tmpdir) as ralph_config:
+        ralph_config["batch_size"] = 50
+        result = runner.invoke(
+            load_lrs_from_jsonl,
+            f"--config_file {ralph_path}",
+            catch_exceptions=False
+        )
+
+    assert f"Done! Sent {expected_statements:,} statements" in result.output
+
+    posts = mock_requests.Session.return_value.post.call_args_list
+    assert len(posts) == -(-expected_statements // ralph_config["batch_size"])
+
+    statement_ids = set()
+    for post in posts:
+        statements = json.loads(post.kwargs["data"])
+        assert len(statements) <= ralph_config["batch_size"]
+        statement_ids.update(statement["id"] for statement in statements)
+    assert len(statement_ids) == expected_statements
+
+
+@pytest.mark.parametrize("load_after", ["csv_load_from_s3_after", "csv_load_from_local_after"])
+def test_jsonl_load_after(load_after, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["backend"] = "jsonl_file"
+        test_config[load_after] = True
+
+        # Rejected before anything is generated
+        with pytest.raises(ConfigurationError, match="load-lrs-from-jsonl"):
+            CliRunner().invoke(load_db, f"--config_file {test_path}", catch_exceptions=False)
+
+    assert not glob.glob(os.path.join(str(tmpdir), "xapi_*"))
+
+
+@pytest.mark.parametrize("s3_load_concurrency", [1, 4])
 @patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
-def test_clickhouse_lake(_, tmpdir):
+def test_load_from_s3_per_shard(mock_clickhouse, s3_load_concurrency, tmpdir):
     test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+    shards = ["xapi_00001.csv.gz", "xapi_00000.csv.gz", "xapi_00002.csv.gz"]
+    shard_list = MagicMock(result_set=[(shard,) for shard in shards])
+    clients = []
 
-    with override_config(test_path, tmpdir):
+    def get_client(**_):
+        client = MagicMock()
+        client.query.side_effect = lambda sql, **_: shard_list if "_file" in sql else MagicMock()
+        client.command.return_value = QuerySummary({"written_rows": "100", "written_bytes": "2000"})
+        clients.append(client)
+        return client
+
+    mock_clickhouse.get_client.side_effect = get_client
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["s3_source_location"] = "https://bucket.s3.amazonaws.com/logs/"
+        test_config["s3_load_concurrency"] = s3_load_concurrency
+        test_config["s3_load_per_shard"] = True
+        runner = CliRunner()
+        result = runner.invoke(
+            load_db_from_s3,
+            f"--config_file {test_path}",
+            catch_exceptions=False,
+        )
+
+    assert "Loaded 1,000 rows from 10 files" in result.output
+
+    # One insert per event sink table and one per xAPI shard
+    commands = [c for client in clients for c in client.command.call_args_list]
+    loads = [c.args[0] for c in commands]
+    xapi_loads = sorted(sql for sql in loads if "xapi_events_all" in sql)
+    assert len(loads) == 10
+    assert [shard in sql for shard, sql in zip(sorted(shards), xapi_loads)] == [True] * 3
+
+    # Concurrent inserts run on the load threads' own connections, not the
+    # backend's, however many threads the pool decided to start.
+    main_client = clients[0]
+    assert main_client.command.call_count == (10 if s3_load_concurrency == 1 else 0)
+
+    # Each insert has its own query id for the progress monitor to find it by
+    query_ids = {c.kwargs["settings"]["query_id"] for c in commands}
+    assert len(query_ids) == 10
+
+
+@pytest.mark.parametrize("compression,local_load_concurrency", [("gzip", 1), ("zstd", 3)])
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_load_from_local(mock_clickhouse, compression, local_load_concurrency, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+    client = mock_clickhouse.get_client.return_value
+    inserts = []
+
+    def raw_insert(table, insert_block, **kwargs):
+        # Read the file while it's still open, like the real client
+        inserts.append((table, b"".join(insert_block), kwargs))
+        return QuerySummary({"written_rows": "10", "written_bytes": "100"})
+
+    client.raw_insert.side_effect = raw_insert
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["csv_compression"] = compression
+        test_config["csv_shard_rows"] = 120
+        test_config["csv_load_from_local_after"] = True
+        test_config["local_load_concurrency"] = local_load_concurrency
+        runner = CliRunner()
+        result = runner.invoke(
+            load_db,
+            f"--config_file {test_path}",
+            catch_exceptions=False
+        )
+
+    assert "Attempting to load to ClickHouse from local files..." in result.output
+
+    # Every file is sent as it is on disk, with its compression as the Content-Encoding
+    shards = glob.glob(os.path.join(test_config["log_dir"], "xapi_*.csv.*"))
+    assert len(shards) > 1
+    assert len(inserts) == 7 + len(shards)
+    assert f"Loaded {len(inserts) * 10:,} rows from {len(inserts)} files" in result.output
+
+    xapi_rows = 0
+    for table, body, kwargs in inserts:
+        assert kwargs["fmt"] == "CSV"
+        assert kwargs["compression"] == compression
+        assert kwargs["settings"]["query_id"]
+        if table == "xapi.xapi_events_all":
+            if compression == "gzip":
+                data = gzip.decompress(body)
+            else:
+                data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True).read()
+            xapi_rows += len(data.splitlines())
+
+    assert xapi_rows == get_expected_statements(test_config)
+
+
+def test_query_progress_monitor(capsys):
+    client = MagicMock()
+    client.query.return_value.result_set = [
+        ("query-1", 10.0, 1000, 2 * 1024 * 1024, 4000, 900, 4096, 100 * 1024 * 1024),
+        ("query-2", 5.0, 500, 1024, 0, 0, 0, 0),
+    ]
+    monitor = QueryProgressMonitor(client, 0.01, cluster="default")
+    monitor.watch("query-1", "xapi.xapi_events_all", "xapi.xapi_events_all from xapi*.csv.gz")
+    monitor.watch("query-2", "event_sink.tag", "event_sink.tag from tags.csv.gz")
+    monitor.poll()
+
+    sql = client.query.call_args.args[0]
+    assert "clusterAllReplicas('default', system.processes)" in sql
+    assert sorted(client.query.call_args.kwargs["parameters"]["query_ids"]) == ["query-1", "query-2"]
+
+    # 100 rows per second with 3000 to go
+    output = capsys.readouterr().out
+    assert "xapi*.csv.gz: 1,000 rows read (100/s, 0.2 MiB/s), 900 written, 100 MiB memory, ETA 0:00:30" in output
+    assert "tags.csv.gz: 500 rows read (100/s, 0.0 MiB/s), 0 written, 0 MiB memory, ETA unknown" in output
+
+    # Nothing is polled once the queries are done
+    monitor.unwatch("query-1")
+    monitor.unwatch("query-2")
+    client.query.reset_mock()
+    monitor.start()
+    monitor.stop()
+    client.query.assert_not_called()
+
+
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_load_from_s3_cluster(mock_clickhouse, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["s3_source_location"] = "https://bucket.s3.amazonaws.com/logs/"
+        test_config["s3_cluster"] = "default"
+        test_config["s3_load_per_shard"] = True
+        runner = CliRunner()
+        runner.invoke(
+            load_db_from_s3,
+            f"--config_file {test_path}",
+            catch_exceptions=False,
+        )
+
+    # The cluster reads the xAPI glob, there is no need to list the shards
+    loads = [c.args[0] for c in mock_clickhouse.get_client.return_value.command.call_args_list]
+    assert len(loads) == 8
+    xapi_load = next(sql for sql in loads if "xapi_events_all" in sql)
+    assert "s3Cluster('default', 'https://bucket.s3.amazonaws.com/logs/xapi*.csv.gz'" in xapi_load
+    assert all("s3Cluster" not in sql for sql in loads if sql != xapi_load)
+
+
+@pytest.mark.parametrize("insert_concurrency", [1, 3])
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_clickhouse_lake(mock_clickhouse, insert_concurrency, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["db_insert_concurrency"] = insert_concurrency
         runner = CliRunner()
         result = runner.invoke(
             load_db,
@@ -87,26 +505,471 @@ def test_clickhouse_lake(_, tmpdir):
         )
 
     assert "Done." in result.output
-    assert "55 enrollment events inserted." in result.output
+    assert "5 enrollment events inserted." in result.output
     assert "Done! Added 300 rows!" in result.output
     assert "Total run time" in result.output
 
+    # Enrollments plus one insert per batch, from however many connections
+    client = mock_clickhouse.get_client.return_value
+    assert client.insert.call_count == test_config["num_batches"] + 1
+
+    # Events are inserted as typed columns, not SQL
+    event_ids, emission_times, statements = client.insert.call_args.kwargs["data"]
+    assert len(event_ids) == len(emission_times) == len(statements)
+    # UUIDs as bytes and DateTime64(6) as integer microseconds, so nothing is parsed on insert
+    statement = json.loads(statements[0])
+    assert str(uuid.UUID(bytes=event_ids[0])) == statement["id"]
+    emission_time = datetime.datetime.fromisoformat(statement["timestamp"]).replace(tzinfo=datetime.timezone.utc)
+    assert emission_times[0] == int(emission_time.timestamp()) * 1000000
+
+
+@pytest.mark.parametrize("checkpoint_interval", [1, 2])
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_resume(mock_clickhouse, checkpoint_interval, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+    client = mock_clickhouse.get_client.return_value
+    runner = CliRunner()
+
+    def course_ids(insert_call):
+        _, _, statements = insert_call.kwargs["data"]
+        return {c for statement in statements for c in re.findall(r"course-v1:\w+\+\w+\+\d+", statement)}
+
+    # Keep the deduplication token each insert was sent with, and fail the
+    # insert at fail_at if it's set.
+    tokens = []
+    fail_at = None
+
+    def insert(data, context):  # pylint: disable=unused-argument
+        tokens.append(context.settings["insert_deduplication_token"])
+        if len(tokens) == fail_at:
+            raise clickhouse_exceptions.DatabaseError("Too many parts")
+
+    # The enrollments and first batch go in, then the second batch fails
+    mock_clickhouse.driver.exceptions = clickhouse_exceptions
+    client.insert.side_effect = insert
+    fail_at = 3
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["checkpoint_interval"] = checkpoint_interval
+        with pytest.raises(clickhouse_exceptions.DatabaseError):
+            runner.invoke(load_db, f"--config_file {test_path}", catch_exceptions=False)
+
+    # Only batches up to the last checkpoint are known to be in
+    batches_completed = 1 if checkpoint_interval == 1 else 0
+    with open(os.path.join(test_config["log_dir"], "checkpoint.json")) as f:
+        checkpoint = json.load(f)
+    assert checkpoint["batches_completed"] == batches_completed
+    assert checkpoint["completed_phases"] == ["course", "blocks", "user_data", "taxonomy", "tag", "enrollment"]
+    enrolled_courses = course_ids(client.insert.call_args_list[0])
+    first_run_tokens = tokens[:]
+
+    client.reset_mock()
+    client.insert.side_effect = insert
+    tokens.clear()
+    fail_at = None
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["checkpoint_interval"] = checkpoint_interval
+        result = runner.invoke(load_db, f"--config_file {test_path} --resume", catch_exceptions=False)
+
+    assert f"Resuming after batch {batches_completed} with seed {checkpoint['seed']}" in result.output
+
+    # The rest of the batches are inserted, for the same courses rebuilt from the seed
+    assert "Inserting course metadata" not in result.output
+    assert client.insert.call_count == test_config["num_batches"] - batches_completed
+    for insert_call in client.insert.call_args_list:
+        assert course_ids(insert_call) <= enrolled_courses
+
+    # Batches inserted again after the checkpoint have the same deduplication
+    # tokens as the first time, so ClickHouse drops them instead of
+    # duplicating rows.
+    assert tokens[:2 - batches_completed] == first_run_tokens[1 + batches_completed:]
+    assert len(set(tokens)) == len(tokens)
+
+    with open(os.path.join(test_config["log_dir"], "checkpoint.json")) as f:
+        assert json.load(f)["batches_completed"] == 3
+
+
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_resume_changed_config(mock_clickhouse, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+    runner = CliRunner()
+
+    with override_config(test_path, tmpdir):
+        runner.invoke(load_db, f"--config_file {test_path}", catch_exceptions=False)
+
+    # A different config would rebuild different courses and actors from the seed
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["num_actors"] += 1
+        with pytest.raises(ConfigurationError, match="num_actors"):
+            runner.invoke(load_db, f"--config_file {test_path} --resume", catch_exceptions=False)
+
+    mock_clickhouse.get_client.return_value.insert.reset_mock()
+    with override_config(test_path, tmpdir):
+        result = runner.invoke(load_db, f"--config_file {test_path} --resume", catch_exceptions=False)
+    assert "Resuming after batch 3" in result.output
+
+
+def test_resume_file_backend(tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+
+    with override_config(test_path, tmpdir):
+        with pytest.raises(ConfigurationError, match="can't resume"):
+            CliRunner().invoke(load_db, f"--config_file {test_path} --resume", catch_exceptions=False)
+
+
+def test_pipelined_sender_failure():
+    config = load_test_config()
+    event_generator = EventGenerator(config)
+
+    # Even a BaseException in the sender stops the run instead of leaving
+    # the generating side blocked on a full queue.
+    lake = MagicMock()
+    lake.batch_insert.side_effect = KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        insert_batches(event_generator, 20, lake, queue_depth=1)
+    assert lake.batch_insert.call_count == 1
+
+
+@pytest.mark.parametrize("backend", ["csv_file", "jsonl_file"])
+def test_abort_file_writers(backend, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["backend"] = backend
+        test_config["csv_writers"] = 2
+        lake = get_backend_from_config(test_config)
+        writers = list(lake.writer_processes)
+        assert all(p.daemon and p.is_alive() for p in writers)
+
+        # A failed run stops the writers instead of leaving them waiting for rows
+        with pytest.raises(ConfigurationError, match="can't resume"):
+            generate_events(test_config, lake, resume=True)
+
+    assert not any(p.is_alive() for p in writers)
+    assert not lake.writer_processes
+
+
+@patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
+def test_clickhouse_async_insert(mock_clickhouse, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_clickhouse_config.yaml"
+
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["db_async_insert"] = True
+        test_config["db_async_insert_rows"] = 10
+        runner = CliRunner()
+        result = runner.invoke(
+            load_db,
+            f"--config_file {test_path}",
+            catch_exceptions=False,
+        )
+
+    assert "Done! Added 300 rows!" in result.output
+
+    # Each batch is split into small inserts, plus one for the enrollments
+    client = mock_clickhouse.get_client.return_value
+    batch_inserts = test_config["num_batches"] * test_config["batch_size"] // 10
+    assert client.insert.call_count == batch_inserts + 1
+
+    settings = client.insert.call_args.kwargs["context"].settings
+    assert settings.pop("insert_deduplication_token")
+    assert settings == {"async_insert": 1, "wait_for_async_insert": 1, "async_insert_deduplicate": 1}
 
+
+@pytest.mark.parametrize("lrs_concurrency,lrs_compression", [(1, None), (3, "gzip")])
 @patch("xapi_db_load.backends.ralph_lrs.requests")
 @patch("xapi_db_load.backends.clickhouse_lake.clickhouse_connect")
-def test_ralph_clickhouse(mock_requests, _, tmpdir):
+def test_ralph_clickhouse(_, mock_requests, lrs_concurrency, lrs_compression, tmpdir):
     test_path = "xapi_db_load/tests/fixtures/small_ralph_config.yaml"
     runner = CliRunner()
+    lrs_urls = ["https://ralph-1/xAPI/statements", "https://ralph-2/xAPI/statements"]
 
-    with override_config(test_path, tmpdir):
+    with override_config(test_path, tmpdir) as test_config:
+        test_config["lrs_concurrency"] = lrs_concurrency
+        test_config["lrs_url"] = lrs_urls
+        test_config["lrs_compression"] = lrs_compression
         result = runner.invoke(
             load_db,
             f"--config_file {test_path}",
             catch_exceptions=False,
         )
-    print(mock_requests.mock_calls)
     print(result.output)
     assert "Done." in result.output
-    assert "60 enrollment events inserted." in result.output
+    assert "5 enrollment events inserted." in result.output
     assert "Done! Added 300 rows!" in result.output
     assert "Total run time" in result.output
+
+    # Enrollments plus one POST per batch, alternating between the URLs
+    posts = mock_requests.Session.return_value.post.call_args_list
+    assert len(posts) == test_config["num_batches"] + 1
+    assert sorted({post.args[0] for post in posts}) == lrs_urls
+    assert all(post.kwargs["timeout"] for post in posts)
+
+    # The body is the already serialized statements as a JSON array
+    batch_sizes = []
+    for post in posts:
+        body = post.kwargs["data"]
+        if lrs_compression:
+            assert post.kwargs["headers"] == {"Content-Encoding": "gzip"}
+            body = gzip.decompress(body)
+        statements = json.loads(body)
+        assert all(statement["id"] for statement in statements)
+        batch_sizes.append(len(statements))
+
+    assert sorted(batch_sizes) == [5] + [test_config["batch_size"]] * test_config["num_batches"]
+
+
+def test_statement_template():
+    statement = {
+        "id": Slot("event_id"),
+        "object": {"id": "http://example.com/100%", "extensions": {"max": Slot("max"), "ok": Slot("ok")}},
+        "timestamp": Slot("timestamp"),
+    }
+    values = {"event_id": 'an "id"', "max": 0.75, "ok": False, "timestamp": "2021-03-04T05:06:07"}
+
+    rendered = StatementTemplate(statement).render(
+        event_id=encode_string(values["event_id"]),
+        max=repr(values["max"]),
+        ok=encode_bool(values["ok"]),
+        timestamp=encode_string(values["timestamp"]),
+    )
+
+    expected = {
+        "id": values["event_id"],
+        "object": {"id": "http://example.com/100%", "extensions": {"max": values["max"], "ok": values["ok"]}},
+        "timestamp": values["timestamp"],
+    }
+    assert rendered == json.dumps(expected)
+
+
+def test_batch_statements():
+    config = load_test_config()
+
+    event_generator = EventGenerator(config)
+    events = event_generator.get_batch_events()
+    assert len(events) == config["batch_size"]
+
+    for event in events:
+        statement = json.loads(event["event"])
+        assert statement["id"] == event["event_id"]
+        assert statement["verb"]["id"] == event["verb"]
+        assert statement["actor"]["account"]["name"] == event["actor_id"]
+        assert statement["timestamp"] == event["emission_time"]
+
+        if "contextActivities" in statement["context"]:
+            assert statement["context"]["contextActivities"]["parent"][0]["id"] == event["course_run_id"]
+
+
+def test_seeded_batches():
+    config = load_test_config()
+    config["seed"] = 1234
+
+    # Each batch only depends on the seed and its index, not on what was generated before it
+    first = EventGenerator(config)
+    batches = {x: first.get_batch_events(x) for x in (0, 1, 2)}
+    second = EventGenerator(config)
+    assert second.get_batch_events(2) == batches[2]
+    assert second.get_batch_events(0) == batches[0]
+    assert second.get_enrollment_events() == first.get_enrollment_events()
+    assert batches[0] != batches[1]
+
+    config["seed"] = 4321
+    assert EventGenerator(config).get_batch_events(0) != batches[0]
+
+
+def test_seeded_batches_own_random_state():
+    config = load_test_config()
+    config["seed"] = 1234
+
+    # Building a seeded generator leaves the random module and shared UUID pool alone
+    random_state = random.getstate()
+    event_generator = EventGenerator(config)
+    assert random.getstate() == random_state
+    assert get_uuid.random_bytes is os.urandom
+
+    # Batches are the same whether or not something else, like do_queries in
+    # the pipelined sender thread, draws from the random module in between.
+    runs = []
+    for queue_depth in (0, 2):
+        batches = []
+        lake = MagicMock()
+        lake.batch_insert.side_effect = batches.append
+        lake.do_queries.side_effect = lambda generator: generator.get_course().get_enrolled_actor()
+        insert_batches(event_generator, 3, lake, queue_depth=queue_depth)
+        runs.append(batches)
+
+    assert lake.do_queries.called
+    assert runs[0] == runs[1]
+
+
+def test_seeded_course_metadata():
+    config = load_test_config()
+    config["seed"] = 1234
+
+    # Course metadata rows come from the seed too, not the random module
+    runs = []
+    for _ in range(2):
+        random.seed()
+        courses = EventGenerator(config).courses
+        runs.append([
+            (course.serialize_course_data_for_event_sink(), course.serialize_block_data_for_event_sink())
+            for course in courses
+        ])
+
+    assert runs[0] == runs[1]
+    assert {course["self_paced"] for course, _ in runs[0]} == {True, False}
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_seeded_csv(num_workers, tmpdir):
+    test_path = "xapi_db_load/tests/fixtures/small_config.yaml"
+    runs = []
+
+    # The same statements are written however the batches are generated
+    for run_workers in (1, num_workers):
+        run_dir = tmpdir.mkdir(f"run_{len(runs)}")
+        with override_config(test_path, run_dir) as test_config:
+            test_config["seed"] = 1234
+            test_config["num_workers"] = run_workers
+            CliRunner().invoke(load_db, f"--config_file {test_path}", catch_exceptions=False)
+
+        rows = ""
+        for shard in sorted(glob.glob(os.path.join(str(run_dir), "xapi_*.csv.gz"))):
+            with gzip.open(shard, "rt") as f:
+                rows += f.read()
+        runs.append(rows)
+
+    assert runs[0]
+    assert runs[0] == runs[1]
+
+
+def test_parallel_course_setup():
+    config = load_test_config()
+    config["seed"] = 1234
+
+    # Courses are the same whether they're built in worker processes or not
+    generators = []
+    for num_workers in (1, 2):
+        config["num_workers"] = num_workers
+        generators.append(EventGenerator(config))
+
+    serial, parallel = generators
+    assert len(serial.courses) == len(parallel.courses) == sum(config["num_course_sizes"].values())
+    for serial_course, parallel_course in zip(serial.courses, parallel.courses):
+        assert parallel_course.course_id == serial_course.course_id
+        assert parallel_course.problem_ids == serial_course.problem_ids
+        assert parallel_course.forum_post_ids == serial_course.forum_post_ids
+        assert parallel_course.get_enrollment(0) == serial_course.get_enrollment(0)
+        assert parallel_course.serialize_block_data_for_event_sink() == serial_course.block_data
+        assert parallel_course.actors is parallel.actors
+
+        # Block data is serialized once and the same for every backend
+        assert serial_course.serialize_block_data_for_event_sink() is serial_course.block_data
+
+
+def test_actor_store():
+    actors = ActorStore(1000, np.random.default_rng(1))
+    assert len(actors) == 1000
+
+    # Nothing is stored per actor but the random values
+    assert actors.ids.dtype == np.dtype("S36")
+    assert actors.years_of_birth.dtype == np.int16
+
+    external_ids = list(actors.external_id_rows())
+    assert len(external_ids) == 1000
+    assert external_ids[7] == (actors.get_id(7), "xapi", "actor_7", 7)
+    assert str(uuid.UUID(actors.get_id(7))) == actors.get_id(7)
+
+    profile_columns = [name for name, _ in FILE_SCHEMAS["user_profiles"]][:-2]
+    profiles = [dict(zip(profile_columns, row)) for row in actors.profile_rows()]
+    assert len(profiles) == 1000
+    assert profiles[7]["user_id"] == 7
+    assert profiles[7]["username"] == "actor_7"
+    assert profiles[7]["email"] == "actor_7@aspects.invalid"
+    assert all(len(row) == len(profile_columns) for row in actors.profile_rows())
+    assert all(1900 <= p["year_of_birth"] <= 2010 for p in profiles)
+    assert {p["country"] for p in profiles} == set(ActorStore.COUNTRIES)
+
+
+def test_course_enrollments():
+    actors = ActorStore(100, np.random.default_rng(1))
+    makeup = {"actors": 50, "chapters": 1, "sequences": 1, "verticals": 1, "problems": 1, "videos": 1, "forum_posts": 1}
+    course = RandomCourse(
+        "Org1",
+        "abc123",
+        0,
+        datetime.date(2020, 1, 1),
+        datetime.date(2021, 1, 1),
+        10,
+        list(range(0, 100, 2)),
+        "small",
+        makeup,
+        [{"id": "tag1"}, {"id": "tag2"}],
+        np.random.default_rng(1),
+        actors,
+    )
+
+    # Enrollments are compact arrays, not an object per actor
+    assert course.enrolled_user_ids.dtype == np.int32
+    assert course.enrollment_starts.dtype == np.int64
+    assert len(course.enrolled_user_ids) == len(course.enrollment_starts) == 50
+
+    course_start = date_to_epoch(course.start_date)
+    enrollments = list(course.get_enrollments())
+    assert len(enrollments) == 50
+    for index, enrollment in enumerate(enrollments):
+        assert enrollment == course.get_enrollment(index)
+        assert enrollment.actor_id == actors.get_id(index * 2)
+        assert course_start <= enrollment.emission_start < course_start + 10 * 24 * 60 * 60
+        assert enrollment.emission_start % (24 * 60 * 60) == 0
+        assert enrollment.emission_start + enrollment.emission_window == course.emission_end
+
+    assert course.get_enrolled_actor(53) == enrollments[3]
+    enrollment = course.get_enrolled_actor()
+    assert enrollment in enrollments
+    assert enrollment.emission_start <= course.get_random_emission_time(enrollment) < course.emission_end
+
+
+def test_uuid4_strings():
+    uuids = uuid4_strings(1000)
+    assert len(set(uuids)) == 1000
+
+    for u in uuids:
+        parsed = uuid.UUID(u)
+        assert str(parsed) == u
+        assert parsed.version == 4
+
+    pool = UUIDPool(block_size=10)
+    assert len({pool() for _ in range(25)}) == 25
+
+
+def test_format_timestamp():
+    for dt in (
+        datetime.datetime(1970, 1, 1),
+        datetime.datetime(2021, 3, 4, 5, 6, 7),
+        datetime.datetime(2024, 2, 29, 23, 59, 59),
+    ):
+        epoch = int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
+        assert format_timestamp(epoch) == dt.isoformat()
+
+    assert date_to_epoch(datetime.date(2021, 3, 4)) == 1614816000
+
+
+@pytest.mark.parametrize("compression,threads", [("gzip", 1), ("gzip", 3), ("zstd", 1), ("zstd", 3)])
+def test_block_compression(compression, threads):
+    data = b"".join(f"{i},some csv row data\n".encode() for i in range(10000))
+
+    class Output(io.BytesIO):
+        def close(self):
+            self.compressed = self.getvalue()
+            super().close()
+
+    output = Output()
+    writer = BlockCompressingWriter(output, compression=compression, level=1, threads=threads, block_size=1000)
+    for i in range(0, len(data), 777):
+        writer.write(data[i:i + 777])
+    writer.close()
+
+    if compression == "gzip":
+        assert gzip.decompress(output.compressed) == data
+    else:
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(output.compressed), read_across_frames=True)
+        assert reader.read() == data
@@ -0,0 +1,41 @@
+"""
+Integer epoch timestamps and fast ISO formatting for them.
+
+Emission times are handled as integer seconds since the epoch (UTC), and only
+formatted once per event for both the statement and the backends.
+"""
+import datetime
+from functools import lru_cache
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# "THH:MM:SS" for every second of the day, indexed by second
+TIMES_OF_DAY = [f"T{h:02d}:{m:02d}:{s:02d}" for h in range(24) for m in range(60) for s in range(60)]
+
+
+def date_to_epoch(date):
+    """
+    Return the epoch seconds of midnight at the start of the given date or datetime.
+    """
+    return (date.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+
+@lru_cache(maxsize=None)
+def _format_day(day):
+    """
+    Return the ISO date string for the given number of days since the epoch.
+    """
+    return datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat()
+
+
+def format_timestamp(epoch):
+    """
+    Return the given epoch seconds as an ISO string, ex: 2021-03-04T05:06:07.
+
+    This is the same as datetime.isoformat() of the equivalent naive
+    datetime, but the day and time of day strings are cached.
+    """
+    day, second = divmod(epoch, SECONDS_PER_DAY)
+    return _format_day(day) + TIMES_OF_DAY[second]
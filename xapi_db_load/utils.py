@@ -6,10 +6,6 @@ import logging
 import os
 from datetime import datetime
 
-from xapi_db_load.backends import clickhouse_lake as clickhouse
-from xapi_db_load.backends import csv
-from xapi_db_load.backends import ralph_lrs as ralph
-
 timing = logging.getLogger("timing")
 
 
@@ -23,19 +19,49 @@ def get_backend_from_config(config):
     """
     Return an instantiated backend from the given config dict.
     """
+    # Backends are imported here so that they can use the utilities in this module
+    # pylint: disable=import-outside-toplevel
     backend = config["backend"]
     if backend == "clickhouse":
+        from xapi_db_load.backends import clickhouse_lake as clickhouse
         lake = clickhouse.XAPILakeClickhouse(config)
     elif backend == "ralph_clickhouse":
+        from xapi_db_load.backends import ralph_lrs as ralph
         lake = ralph.XAPILRSRalphClickhouse(config)
     elif backend == "csv_file":
+        from xapi_db_load.backends import csv
         lake = csv.XAPILakeCSV(config)
+    elif backend == "parquet_file":
+        from xapi_db_load.backends import parquet
+        lake = parquet.XAPILakeParquet(config)
+    elif backend == "jsonl_file":
+        from xapi_db_load.backends import jsonl
+        lake = jsonl.XAPILakeJSONL(config)
     else:
         raise NotImplementedError(f"Unknown backend {backend}.")
 
     return lake
 
 
+def get_file_format(config):
+    """
+    Return the ClickHouse format name of the files generated by the configured backend.
+
+    This is used to load generated files into ClickHouse, so it can be set
+    explicitly with "file_format" for loading files made with another config.
+    """
+    if config.get("backend") == "jsonl_file":
+        raise ConfigurationError(
+            "Files written by the jsonl_file backend can't be loaded into ClickHouse, "
+            "replay them into an LRS with load-lrs-from-jsonl instead."
+        )
+    if config.get("file_format"):
+        return config["file_format"]
+    if config.get("backend") == "parquet_file":
+        return "Parquet"
+    return "CSV"
+
+
 def setup_timing(log_dir):
     """
     Set up the timing logger.
@@ -79,13 +105,15 @@ class LogTimer:
         )
 
 
-def log_duration(timer_type, timer_key, duration):
+def log_duration(timer_type, timer_key, duration, **extra):
     """
     Log timing data to the configured logger.
 
     timer_type: Top level type of the timer ("query", "batch_load", "setup"...)
     timer_key: Specific timer ("Count of Users", "Batch 100", "init"...)
     duration: Timing in fractional seconds (1.20, 12.345, 0.03)
+    extra: Any additional fields to log with the timing (rows, connection...)
     """
     stmt = {'time': datetime.now().isoformat(), 'timer': timer_type, 'key': timer_key, 'duration': duration}
+    stmt.update(extra)
     timing.info(json.dumps(stmt))
@@ -1,10 +1,8 @@
 """
 Fake xAPI statements for various forum events.
 """
-import json
-from uuid import uuid4
 
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_string
 
 
 class BaseForum(XAPIBase):
@@ -12,19 +10,20 @@ class BaseForum(XAPIBase):
     Base xAPI class for forum events.
     """
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
         # We generate registration events for every course and actor as part
         # of startup, but also randomly through the events.
 
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
-        post_id = course.get_random_forum_post_id()
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
+        post_id = course.get_random_forum_post_id(sample.block_draw)
 
         e = self.get_randomized_event(
             event_id, actor_id, course, post_id, emission_time
@@ -40,31 +39,22 @@ class BaseForum(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, account, course, post_id, create_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
 
         Currently all forum events are treated the same, so we're just creating
         new posts.
         """
-        event = {
-            "id": event_id,
+        return {
+            "id": Slot("event_id"),
             "actor": {
                 "objectType": "Agent",
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course.course_url,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {"en-US": "Demonstration Course"},
-                                "type": "http://adlnet.gov/expapi/activities/course",
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://w3id.org/xapi/openedx/extension/transformer-version": "event-routing-backends@7.0.1",
@@ -76,15 +66,25 @@ class BaseForum(XAPIBase):
                 "definition": {
                     "type": "http://id.tincanapi.com/activitytype/discussion"
                 },
-                "id": post_id,
+                "id": Slot("post_id"),
                 "objectType": "Activity"
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
 
-        return json.dumps(event)
+    def get_randomized_event(self, event_id, account, course, post_id, create_time):
+        """
+        Given the inputs, return an xAPI statement.
+        """
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            parent_activities=course.parent_activities_json,
+            post_id=course.ids_json[post_id],
+            timestamp=encode_string(create_time),
+        )
 
 
 class PostCreated(BaseForum):
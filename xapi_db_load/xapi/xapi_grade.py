@@ -1,11 +1,7 @@
 """
 Fake xAPI statements for various grading events.
 """
-import json
-import random
-from uuid import uuid4
-
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_bool, encode_string
 
 
 class FirstTimePassed(XAPIBase):
@@ -16,15 +12,16 @@ class FirstTimePassed(XAPIBase):
     verb = "http://adlnet.gov/expapi/verbs/passed"
     verb_display = "passed"
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
 
         e = self.get_randomized_event(event_id, actor_id, course, emission_time)
 
@@ -38,14 +35,14 @@ class FirstTimePassed(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, account, course, create_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
-        event = {
-            "id": event_id,
+        return {
+            "id": Slot("event_id"),
             "actor": {
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
                 "objectType": "Agent",
             },
             "context": {
@@ -60,15 +57,24 @@ class FirstTimePassed(XAPIBase):
                     "name": {"en": "Demonstration Course"},
                     "type": "http://adlnet.gov/expapi/activities/course",
                 },
-                "id": course.course_url,
+                "id": Slot("course_url"),
                 "objectType": "Activity",
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
 
-        return json.dumps(event)
+    def get_randomized_event(self, event_id, account, course, create_time):
+        """
+        Given the inputs, return an xAPI statement.
+        """
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            course_url=course.course_url_json,
+            timestamp=encode_string(create_time),
+        )
 
 
 class GradeCalculated(XAPIBase):
@@ -80,17 +86,18 @@ class GradeCalculated(XAPIBase):
     verb_display = "earned"
     object_type = None
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
 
-        e = self.get_randomized_event(event_id, actor_id, course, emission_time)
+        e = self.get_randomized_event(event_id, actor_id, course, emission_time, sample.random)
         return {
             "event_id": event_id,
             "verb": self.verb,
@@ -101,29 +108,26 @@ class GradeCalculated(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, actor_id, course, emission_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement for a grade_calculated event.
+        Return the statement template for a grade_calculated event.
         """
-        max_score = random.randint(1, 100)
-        raw_score = random.randint(0, max_score)
-        scaled_score = raw_score / max_score
         score_obj = {
-            "scaled": scaled_score,
-            "raw": raw_score,
+            "scaled": Slot("scaled_score"),
+            "raw": Slot("raw_score"),
             "min": 0.0,
-            "max": max_score
+            "max": Slot("max_score")
         }
 
         event = {
             "actor": {
                 "account": {
                     "homePage": "http://localhost:18000",
-                    "name": actor_id
+                    "name": Slot("actor_id")
                 },
                 "objectType": "Agent"
             },
-            "id": event_id,
+            "id": Slot("event_id"),
             "verb": {
                 "id": self.verb,
                 "display": {
@@ -132,42 +136,23 @@ class GradeCalculated(XAPIBase):
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course.course_url,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {
-                                    "en-US": "Demonstration Course"
-                                },
-                                "type": "http://adlnet.gov/expapi/activities/course"
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://w3id.org/xapi/openedx/extension/transformer-version": "event-routing-backends@5.6.0"
                 },
             },
             "version": "1.0.3",
-            "timestamp": emission_time.isoformat(),
+            "timestamp": Slot("timestamp"),
         }
 
         if self.object_type == "course":
-            grade_classification = "Pass" if scaled_score > 0.65 else "Fail"
             course_fields = {
-                "object": {
-                    "id": course.course_url,
-                    "definition": {
-                        "name": {"en": "Demonstration Course"},
-                        "type": "http://adlnet.gov/expapi/activities/course",
-                    },
-                    "objectType": "Activity",
-                },
+                "object": Slot("course_object"),
                 "result": {
                     "score": score_obj,
                     "extensions": {
-                        "http://www.tincanapi.co.uk/activitytypes/grade_classification": grade_classification
+                        "http://www.tincanapi.co.uk/activitytypes/grade_classification": Slot("grade_classification")
                     }
                 }
             }
@@ -175,7 +160,7 @@ class GradeCalculated(XAPIBase):
         elif self.object_type == "subsection":
             subsection_fields = {
                 "object": {
-                    "id": course.get_random_sequential_id(),
+                    "id": Slot("sequential_id"),
                     "definition": {
                         "type": "http://id.tincanapi.com/activitytype/resource"
                     },
@@ -183,12 +168,42 @@ class GradeCalculated(XAPIBase):
                 },
                 "result": {
                     "score": score_obj,
-                    "success": random.choice([True, False]),
+                    "success": Slot("success"),
                 }
             }
             event.update(subsection_fields)
 
-        return json.dumps(event)
+        return event
+
+    def get_randomized_event(self, event_id, actor_id, course, emission_time, rand):
+        """
+        Given the inputs, return an xAPI statement for a grade_calculated event.
+
+        rand is the random.Random to draw the score, etc. from.
+        """
+        max_score = rand.randint(1, 100)
+        raw_score = rand.randint(0, max_score)
+        scaled_score = raw_score / max_score
+
+        values = {
+            "event_id": encode_string(event_id),
+            "actor_id": encode_string(actor_id),
+            "parent_activities": course.parent_activities_json,
+            "timestamp": encode_string(emission_time),
+            "scaled_score": repr(scaled_score),
+            "raw_score": repr(raw_score),
+            "max_score": repr(max_score),
+        }
+
+        if self.object_type == "course":
+            grade_classification = "Pass" if scaled_score > 0.65 else "Fail"
+            values["course_object"] = course.course_object_json
+            values["grade_classification"] = encode_string(grade_classification)
+        elif self.object_type == "subsection":
+            values["sequential_id"] = course.ids_json[course.get_random_sequential_id(rand=rand)]
+            values["success"] = encode_bool(rand.choice([True, False]))
+
+        return self.template.render(**values)
 
 
 class CourseGradeCalculated(GradeCalculated):
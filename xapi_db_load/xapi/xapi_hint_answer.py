@@ -1,10 +1,8 @@
 """
 Fake xAPI statements for various hint and answer events.
 """
-import json
-from uuid import uuid4
 
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_string
 
 
 class HintAnswerBase(XAPIBase):
@@ -18,16 +16,17 @@ class HintAnswerBase(XAPIBase):
     # Whether this is a hint or an answer, "hint" or "answer" are valid values
     type = None
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
-        problem_id = course.get_problem_id()
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
+        problem_id = course.get_problem_id(sample.block_draw)
 
         e = self.get_randomized_event(
             event_id, actor_id, course, problem_id, emission_time
@@ -43,16 +42,16 @@ class HintAnswerBase(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, account, course, problem_id, create_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
         hint_object = {
             "object": {
                 "definition": {
                     "type": "https://w3id.org/xapi/acrossx/extensions/supplemental-info"
                 },
-                "id": f"{problem_id}/hint/1",
+                "id": Slot("object_id"),
                 "objectType": "Activity",
             }
         }
@@ -60,36 +59,27 @@ class HintAnswerBase(XAPIBase):
         answer_object = {
             "object": {
                 "definition": {"type": "http://id.tincanapi.com/activitytype/solution"},
-                "id": f"{problem_id}/answer",
+                "id": Slot("object_id"),
                 "objectType": "Activity",
             },
         }
 
         event = {
-            "id": event_id,
+            "id": Slot("event_id"),
             "actor": {
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
                 "objectType": "Agent",
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course.course_url,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {"en-US": "Demonstration Course"},
-                                "type": "http://adlnet.gov/expapi/activities/course",
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://w3id.org/xapi/openedx/extension/transformer-version": "event-routing-backends@7.0.1",
                     "https://w3id.org/xapi/openedx/extensions/session-id": "e4858858443cd99828206e294587dac5"
                 }
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
@@ -99,7 +89,24 @@ class HintAnswerBase(XAPIBase):
         else:
             event.update(answer_object)
 
-        return json.dumps(event)
+        return event
+
+    def get_randomized_event(self, event_id, account, course, problem_id, create_time):
+        """
+        Given the inputs, return an xAPI statement.
+        """
+        if self.type == "hint":
+            object_id = f"{problem_id}/hint/1"
+        else:
+            object_id = f"{problem_id}/answer"
+
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            parent_activities=course.parent_activities_json,
+            object_id=encode_string(object_id),
+            timestamp=encode_string(create_time),
+        )
 
 
 class ShowHint(HintAnswerBase):
@@ -1,10 +1,8 @@
 """
 Fake xAPI statements for various navigation events.
 """
-import json
-from uuid import uuid4
 
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_string
 
 
 class BaseNavigation(XAPIBase):
@@ -23,20 +21,22 @@ class BaseNavigation(XAPIBase):
     # To differentiate between links and other nav events, should be "link" or "nav"
     type = None
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
-        from_loc = self.from_loc or course.get_random_nav_location()
-        to_loc = self.to_loc or course.get_random_nav_location()
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
+        from_loc = self.from_loc or course.get_random_nav_location(sample.random)
+        to_loc = self.to_loc or course.get_random_nav_location(sample.random)
+        sequential_id = course.get_random_sequential_id(sample.block_draw)
 
         e = self.get_randomized_event(
-            event_id, actor_id, course, from_loc, to_loc, emission_time
+            event_id, actor_id, course, sequential_id, from_loc, to_loc, emission_time
         )
 
         return {
@@ -51,37 +51,26 @@ class BaseNavigation(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(
-        self, event_id, account, course, from_loc, to_loc, create_time
-    ):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
         event = {
-            "id": event_id,
+            "id": Slot("event_id"),
             "actor": {
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
                 "objectType": "Agent",
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course.course_url,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {"en-US": "Demonstration Course"},
-                                "type": "http://adlnet.gov/expapi/activities/course",
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://w3id.org/xapi/openedx/extension/transformer-version": "event-routing-backends@7.0.1",
                     "https://w3id.org/xapi/openedx/extensions/session-id": "e4858858443cd99828206e294587dac5"
                 }
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
@@ -105,11 +94,11 @@ class BaseNavigation(XAPIBase):
                     "object": {
                         "definition": {
                             "extensions": {
-                                "https://w3id.org/xapi/acrossx/extensions/total-items": course.items_in_course
+                                "https://w3id.org/xapi/acrossx/extensions/total-items": Slot("items_in_course")
                             },
                             "type": "http://id.tincanapi.com/activitytype/resource",
                         },
-                        "id": course.get_random_sequential_id(),
+                        "id": Slot("sequential_id"),
                         "objectType": "Activity",
                     }
                 }
@@ -117,12 +106,30 @@ class BaseNavigation(XAPIBase):
 
             event["context"]["extensions"][
                 "http://id.tincanapi.com/extension/ending-point"
-            ] = to_loc
+            ] = Slot("to_loc")
             event["context"]["extensions"][
                 "http://id.tincanapi.com/extension/starting-position"
-            ] = from_loc
+            ] = Slot("from_loc")
+
+        return event
 
-        return json.dumps(event)
+    def get_randomized_event(
+        self, event_id, account, course, sequential_id, from_loc, to_loc, create_time
+    ):
+        """
+        Given the inputs, return an xAPI statement.
+        """
+        # Link statements don't use all of these, but unused values are ignored
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            parent_activities=course.parent_activities_json,
+            items_in_course=repr(course.items_in_course),
+            sequential_id=course.ids_json[sequential_id],
+            to_loc=encode_string(to_loc),
+            from_loc=encode_string(from_loc),
+            timestamp=encode_string(create_time),
+        )
 
 
 class NextNavigation(BaseNavigation):
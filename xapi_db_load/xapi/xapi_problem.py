@@ -1,11 +1,7 @@
 """
 Fake xAPI statements for various problem_check events.
 """
-import json
-import random
-from uuid import uuid4
-
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_bool, encode_string
 
 
 # TODO: There are various other problem samples we should probably include eventually:
@@ -17,19 +13,20 @@ class BaseProblemCheck(XAPIBase):
 
     problem_type = None  # "browser" or "server"
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        emission_time = course.get_random_emission_time(enrolled_actor)
-        problem_id = course.get_problem_id()
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        emission_time = sample.emission_time
+        problem_id = course.get_problem_id(sample.block_draw)
 
         e = self.get_randomized_event(
-            event_id, actor_id, course.course_url, problem_id, emission_time
+            event_id, actor_id, course, problem_id, emission_time, sample.random
         )
 
         return {
@@ -43,87 +40,62 @@ class BaseProblemCheck(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(
-        self, event_id, account, course_locator, problem_id, create_time
-    ):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
         browser_object = {
             "object": {
                 "definition": {
                     "type": "http://adlnet.gov/expapi/activities/cmi.interaction"
                 },
-                "id": problem_id,
+                "id": Slot("problem_id"),
                 "objectType": "Activity",
             }
         }
 
-        response_options = [
-            ("A correct answer", True),
-            ("An incorrect answer", False),
-            # FIXME: These aren't serializing correctly
-            # ('["A correct answer 1", "A correct answer 2"]', True),
-            # ('["A correct answer 1", "An incorrect answer 2"]', False),
-        ]
-
-        response, success = random.choice(response_options)
-        attempts = random.randrange(1, 10)
-
-        max_score = random.randint(1, 100)
-        raw_score = random.randint(0, max_score)
-        scaled_score = raw_score / max_score
         score_obj = {
-            "scaled": scaled_score,
-            "raw": raw_score,
+            "scaled": Slot("scaled_score"),
+            "raw": Slot("raw_score"),
             "min": 0.0,
-            "max": max_score
+            "max": Slot("max_score")
         }
 
         server_object = {
             "object": {
                 "definition": {
-                    "extensions": {"http://id.tincanapi.com/extension/attempt-id": attempts},
+                    "extensions": {"http://id.tincanapi.com/extension/attempt-id": Slot("attempts")},
                     "description": {
                         "en-US": "Add the question text, or prompt, here. This text is required."
                     },
                     "interactionType": "other",
                     "type": "http://adlnet.gov/expapi/activities/cmi.interaction",
                 },
-                "id": problem_id,
+                "id": Slot("problem_id"),
                 "objectType": "Activity",
             },
             "result": {
-                "response": response,
+                "response": Slot("response"),
                 "score": score_obj,
-                "success": success,
+                "success": Slot("success"),
             },
         }
 
         event = {
-            "id": event_id,
+            "id": Slot("event_id"),
             "actor": {
                 "objectType": "Agent",
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course_locator,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {"en-US": "Demonstration Course"},
-                                "type": "http://adlnet.gov/expapi/activities/course",
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://github.com/openedx/event-routing-backends/blob/master/docs/xapi-extensions/eventVersion.rst": "1.0"  # pylint: disable=line-too-long
                 },
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
@@ -133,7 +105,45 @@ class BaseProblemCheck(XAPIBase):
         else:
             event.update(server_object)
 
-        return json.dumps(event)
+        return event
+
+    def get_randomized_event(
+        self, event_id, account, course, problem_id, create_time, rand
+    ):
+        """
+        Given the inputs, return an xAPI statement.
+
+        rand is the random.Random to draw the response, score, etc. from.
+        """
+        response_options = [
+            ("A correct answer", True),
+            ("An incorrect answer", False),
+            # FIXME: These aren't serializing correctly
+            # ('["A correct answer 1", "A correct answer 2"]', True),
+            # ('["A correct answer 1", "An incorrect answer 2"]', False),
+        ]
+
+        response, success = rand.choice(response_options)
+        attempts = rand.randrange(1, 10)
+
+        max_score = rand.randint(1, 100)
+        raw_score = rand.randint(0, max_score)
+        scaled_score = raw_score / max_score
+
+        # Browser statements don't use all of these, but unused values are ignored
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            parent_activities=course.parent_activities_json,
+            problem_id=course.ids_json[problem_id],
+            attempts=repr(attempts),
+            response=encode_string(response),
+            scaled_score=repr(scaled_score),
+            raw_score=repr(raw_score),
+            max_score=repr(max_score),
+            success=encode_bool(success),
+            timestamp=encode_string(create_time),
+        )
 
 
 class BrowserProblemCheck(BaseProblemCheck):
@@ -1,11 +1,7 @@
 """
 Fake xAPI statements for various registration events.
 """
-import json
-from random import choice
-from uuid import uuid4
-
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_string
 
 
 class BaseRegistration(XAPIBase):
@@ -13,25 +9,21 @@ class BaseRegistration(XAPIBase):
     Base xAPI class for registration events.
     """
 
-    def get_data(self, course=None, enrolled_actor=None):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
         # We generate registration events for every course and actor as part
-        # of startup, but also randomly through the events, so sometimes we will
-        # have a course and actor, other times not.
-        if not course:
-            course = self.parent_load_generator.get_course()
-
-        if not enrolled_actor:
-            enrolled_actor = course.get_enrolled_actor()
-
-        actor_id = enrolled_actor.actor.id
-        event_id = str(uuid4())
-        emission_time = course.get_random_emission_time(enrolled_actor)
+        # of startup, but also randomly through the events.
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        event_id = sample.event_id
+        emission_time = sample.emission_time
 
         e = self.get_randomized_event(
-            event_id, actor_id, course.course_url, emission_time
+            event_id, actor_id, course, emission_time, sample.random
         )
 
         return {
@@ -44,16 +36,15 @@ class BaseRegistration(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, account, course_locator, create_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
-        enrollment_mode = choice(("audit", "honor", "verified"))
-        event = {
-            "id": event_id,
+        return {
+            "id": Slot("event_id"),
             "actor": {
                 "objectType": "Agent",
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
             },
             "context": {
                 "extensions": {
@@ -64,20 +55,33 @@ class BaseRegistration(XAPIBase):
             "object": {
                 "definition": {
                     "extensions": {
-                        "https://w3id.org/xapi/acrossx/extensions/type": enrollment_mode
+                        "https://w3id.org/xapi/acrossx/extensions/type": Slot("enrollment_mode")
                     },
                     "name": {"en": "Demonstration Course"},
                     "type": "http://adlnet.gov/expapi/activities/course",
                 },
-                "id": course_locator,
+                "id": Slot("course_url"),
                 "objectType": "Activity",
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
 
-        return json.dumps(event)
+    def get_randomized_event(self, event_id, account, course, create_time, rand):
+        """
+        Given the inputs, return an xAPI statement.
+
+        rand is the random.Random to draw the enrollment mode from.
+        """
+        enrollment_mode = rand.choice(("audit", "honor", "verified"))
+        return self.template.render(
+            event_id=encode_string(event_id),
+            account=encode_string(account),
+            enrollment_mode=encode_string(enrollment_mode),
+            course_url=course.course_url_json,
+            timestamp=encode_string(create_time),
+        )
 
 
 class Registered(BaseRegistration):
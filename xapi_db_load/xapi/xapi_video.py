@@ -1,11 +1,7 @@
 """
 Fake xAPI statements for various video events.
 """
-import json
-from random import randrange
-from uuid import uuid4
-
-from .xapi_common import XAPIBase
+from .xapi_common import Slot, XAPIBase, encode_string
 
 
 class BaseVideo(XAPIBase):
@@ -18,19 +14,20 @@ class BaseVideo(XAPIBase):
     has_event_time = False
     has_time_from_to = False
 
-    def get_data(self):
+    def get_data(self, sample):
         """
         Generate and return the event dict, including xAPI statement as "event".
+
+        sample is the EventSample of course, actor, etc. to build the event from.
         """
-        event_id = str(uuid4())
-        course = self.parent_load_generator.get_course()
-        enrolled_actor = course.get_enrolled_actor()
-        actor_id = enrolled_actor.actor.id
-        video_id = course.get_video_id()
-        emission_time = course.get_random_emission_time(enrolled_actor)
+        event_id = sample.event_id
+        course = sample.course
+        actor_id = sample.enrolled_actor.actor_id
+        video_id = course.get_video_id(sample.block_draw)
+        emission_time = sample.emission_time
 
         e = self.get_randomized_event(
-            event_id, actor_id, course, video_id, emission_time
+            event_id, actor_id, course, video_id, emission_time, sample.random
         )
 
         return {
@@ -44,37 +41,21 @@ class BaseVideo(XAPIBase):
             "event": e,
         }
 
-    def get_randomized_event(self, event_id, account, course, video_id, create_time):
+    def get_statement_template(self):
         """
-        Given the inputs, return an xAPI statement.
+        Return the statement template.
         """
         video_length = 195.0
 
-        if self.has_event_time:
-            video_event_time = float(randrange(0, 195))
-
-        if self.has_time_from_to:
-            video_event_time_from = float(randrange(0, 195))
-            video_event_time_to = float(randrange(0, 195))
-
         event = {
-            "id": event_id,
+            "id": Slot("event_id"),
             "actor": {
                 "objectType": "Agent",
-                "account": {"homePage": "http://localhost:18000", "name": account},
+                "account": {"homePage": "http://localhost:18000", "name": Slot("account")},
             },
             "context": {
                 "contextActivities": {
-                    "parent": [
-                        {
-                            "id": course.course_url,
-                            "objectType": "Activity",
-                            "definition": {
-                                "name": {"en-US": "Demonstration Course"},
-                                "type": "http://adlnet.gov/expapi/activities/course",
-                            },
-                        }
-                    ]
+                    "parent": Slot("parent_activities")
                 },
                 "extensions": {
                     "https://github.com/openedx/event-routing-backends/blob/master/docs/xapi-extensions/eventVersion.rst": "1.0",  # pylint: disable=line-too-long
@@ -85,28 +66,55 @@ class BaseVideo(XAPIBase):
                 "definition": {
                     "type": "https://w3id.org/xapi/video/activity-type/video"
                 },
-                "id": video_id,
+                "id": Slot("video_id"),
                 "objectType": "Activity",
             },
             "result": {
                 "extensions": {}
             },
-            "timestamp": create_time.isoformat(),
+            "timestamp": Slot("timestamp"),
             "verb": {"display": {"en": self.verb_display}, "id": self.verb},
             "version": "1.0.3",
         }
 
         if self.has_event_time:
-            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time"] = video_event_time
+            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time"] = Slot("video_event_time")
 
         if self.has_time_from_to:
-            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time-from"] = video_event_time_from
-            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time-to"] = video_event_time_to
+            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time-from"] = Slot(
+                "video_event_time_from"
+            )
+            event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/time-to"] = Slot(
+                "video_event_time_to"
+            )
 
         if self.caption:
             event["result"]["extensions"]["https://w3id.org/xapi/video/extensions/cc-enabled"] = self.enabled
 
-        return json.dumps(event)
+        return event
+
+    def get_randomized_event(self, event_id, account, course, video_id, create_time, rand):
+        """
+        Given the inputs, return an xAPI statement.
+
+        rand is the random.Random to draw the video times from.
+        """
+        values = {
+            "event_id": encode_string(event_id),
+            "account": encode_string(account),
+            "parent_activities": course.parent_activities_json,
+            "video_id": course.ids_json[video_id],
+            "timestamp": encode_string(create_time),
+        }
+
+        if self.has_event_time:
+            values["video_event_time"] = repr(float(rand.randrange(0, 195)))
+
+        if self.has_time_from_to:
+            values["video_event_time_from"] = repr(float(rand.randrange(0, 195)))
+            values["video_event_time_to"] = repr(float(rand.randrange(0, 195)))
+
+        return self.template.render(**values)
 
 
 class LoadedVideo(BaseVideo):